@@ -0,0 +1,136 @@
+# Состояние уведомлений об изменении цены в виде параллельных массивов NumPy по символам:
+# решение об уведомлении для всех подписчиков символа принимается несколькими операциями над массивами
+import threading
+
+import numpy as np
+
+# Начальная емкость массивов символа; при заполнении емкость удваивается
+INITIAL_CAPACITY = 16
+
+
+# Условие уведомления об изменении цены: изменение change (в процентах) достигло порога и с последнего
+# уведомления прошло не меньше таймаута. Работает и со скалярами, и с массивами NumPy
+def should_alert(change, thresholds, now, alert_timestamps, timeouts):
+    return (abs(change) >= thresholds) & (now - alert_timestamps >= timeouts)
+
+
+class SymbolSubscribers:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.chat_ids = np.zeros(capacity, dtype=np.int64)
+        self.thresholds = np.zeros(capacity)
+        self.timeouts = np.zeros(capacity)
+        # Время последнего уведомления; -inf - уведомлений еще не было
+        self.alert_timestamps = np.zeros(capacity)
+        # Цена при последней проверке; nan - проверок еще не было
+        self.previous_prices = np.zeros(capacity)
+        # chat_id -> номер строки в массивах
+        self.rows = {}
+
+    def add(self, monitor):
+        if self.size == len(self.chat_ids):
+            self._grow(2 * self.size)
+        row = self.size
+        self.size += 1
+        self.rows[monitor["chat_id"]] = row
+        self.chat_ids[row] = monitor["chat_id"]
+        self.thresholds[row] = monitor["change_threshold"]
+        self.timeouts[row] = monitor["alert_timeout"]
+        alert_timestamp = monitor["alert_timestamp"]
+        self.alert_timestamps[row] = -np.inf if alert_timestamp is None else alert_timestamp
+        previous_price = monitor["previous_price"]
+        self.previous_prices[row] = np.nan if previous_price is None else previous_price
+
+    # Удаляет чат, перенося на его место последнюю строку
+    def remove(self, chat_id):
+        row = self.rows.pop(chat_id)
+        last = self.size - 1
+        if row != last:
+            for array in (self.chat_ids, self.thresholds, self.timeouts, self.alert_timestamps, self.previous_prices):
+                array[row] = array[last]
+            self.rows[int(self.chat_ids[row])] = row
+        self.size = last
+
+    def _grow(self, capacity):
+        for name in ("chat_ids", "thresholds", "timeouts", "alert_timestamps", "previous_prices"):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+
+
+class AlertIndex:
+    def __init__(self):
+        # Блокировка нужна, так как обработчики команд и проверка цен работают в разных потоках
+        self.lock = threading.Lock()
+        # symbol -> SymbolSubscribers
+        self.symbols = {}
+        # chat_id -> symbol
+        self.chat_symbols = {}
+
+    # Заносит (или заменяет) настройки и состояние уведомлений чата из его монитора
+    def set_monitor(self, monitor):
+        symbol = f"{monitor['base_asset']}{monitor['quote_asset']}"
+        with self.lock:
+            self._remove_chat(monitor["chat_id"])
+            subscribers = self.symbols.get(symbol)
+            if subscribers is None:
+                subscribers = self.symbols[symbol] = SymbolSubscribers()
+            subscribers.add(monitor)
+            self.chat_symbols[monitor["chat_id"]] = symbol
+
+    def remove_chat(self, chat_id):
+        with self.lock:
+            self._remove_chat(chat_id)
+
+    def _remove_chat(self, chat_id):
+        symbol = self.chat_symbols.pop(chat_id, None)
+        if symbol is None:
+            return
+        subscribers = self.symbols[symbol]
+        subscribers.remove(chat_id)
+        if not subscribers.size:
+            del self.symbols[symbol]
+
+    # Наименьший порог изменения среди подписчиков символа или None
+    def min_threshold(self, symbol):
+        with self.lock:
+            subscribers = self.symbols.get(symbol)
+            if subscribers is None:
+                return None
+            return float(subscribers.thresholds[:subscribers.size].min())
+
+    # Последняя проверенная цена чата или None
+    def previous_price(self, chat_id):
+        with self.lock:
+            symbol = self.chat_symbols.get(chat_id)
+            if symbol is None:
+                return None
+            subscribers = self.symbols[symbol]
+            price = subscribers.previous_prices[subscribers.rows[chat_id]]
+            return None if np.isnan(price) else float(price)
+
+    # Проверяет чаты chat_ids символа при изменении цены change (в процентах) и цене base_price;
+    # запоминает цену и время уведомления. Возвращает массив индексов (в chat_ids) чатов,
+    # которым нужно отправить уведомление
+    def evaluate(self, symbol, chat_ids, change, base_price, now):
+        with self.lock:
+            subscribers = self.symbols.get(symbol)
+            if subscribers is None:
+                return np.empty(0, dtype=np.intp)
+            # Если проверяются все подписчики символа в порядке строк, поиск строк не нужен
+            if len(chat_ids) == subscribers.size and \
+                    np.array_equal(subscribers.chat_ids[:subscribers.size], chat_ids):
+                rows = np.arange(subscribers.size)
+            else:
+                row_of = subscribers.rows
+                rows = np.fromiter((row_of.get(chat_id, -1) for chat_id in chat_ids), dtype=np.intp,
+                                   count=len(chat_ids))
+            # Чаты, отписанные после выбора к проверке, пропускаются
+            known = rows >= 0
+            valid = rows[known]
+            subscribers.previous_prices[valid] = base_price
+            alerted = should_alert(change, subscribers.thresholds[valid], now, subscribers.alert_timestamps[valid],
+                                   subscribers.timeouts[valid])
+            subscribers.alert_timestamps[valid[alerted]] = now
+            return np.flatnonzero(known)[alerted]
@@ -0,0 +1,195 @@
+# Асинхронный движок мониторинга на httpx: запросы цен и свечей, обновление средних
+# и отправка уведомлений выполняются конкурентно в одном цикле событий asyncio
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+
+import metrics
+from weights import request_weight
+from config import BINANCE_API_URL, TELEGRAM_API_URL, TELEGRAM_TOKEN, BINANCE_POOL_SIZE, TELEGRAM_POOL_SIZE, \
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES, TICKER_BATCH_LIMIT, FEED_INTERVAL, ENGINE_CONCURRENCY
+
+
+# Создает асинхронный клиент с пулом соединений, таймаутами и повтором неудачных подключений
+def create_client(base_url, pool_size):
+    transport = httpx.AsyncHTTPTransport(
+        retries=HTTP_RETRIES,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+    )
+    timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(base_url=base_url, transport=transport, timeout=timeout)
+
+
+class AsyncMonitorEngine:
+    # feed - PriceFeed, moving_averages - MovingAverages, price_snapshot - общий снимок цен PriceSnapshot,
+    # evaluate_symbol(symbol, price, ma_value, monitors) -> [(chat_id, text)],
+    # paused() -> True, пока опрос не нужен (например, работает поток WebSocket),
+    # outbox - очередь Outbox; без нее уведомления отправляются напрямую из цикла событий,
+    # recorder - Recorder для записи полученных цен и свечей (None - не записывать),
+    # weights - WeightBudget для учета веса запросов к Binance (None - не учитывать),
+    # is_calm(symbol, price) -> True, если обновление свечей символа можно отложить при нехватке веса
+    def __init__(self, feed, moving_averages, price_snapshot, evaluate_symbol, paused=None, outbox=None,
+                 interval=FEED_INTERVAL, concurrency=ENGINE_CONCURRENCY, recorder=None, weights=None,
+                 is_calm=None):
+        self.feed = feed
+        self.moving_averages = moving_averages
+        self.price_snapshot = price_snapshot
+        self.evaluate_symbol = evaluate_symbol
+        self.paused = paused
+        self.outbox = outbox
+        self.recorder = recorder
+        self.weights = weights
+        self.is_calm = is_calm
+        self.interval = interval
+        self.concurrency = concurrency
+        self.loop = None
+        self.thread = None
+        self.running = False
+        # Незавершенные отправки уведомлений (ссылки нужны, чтобы задачи не собрал сборщик мусора)
+        self.pending = set()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="async-engine", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        # Ограничивает число одновременно выполняемых запросов к внешним сервисам
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with create_client(BINANCE_API_URL, BINANCE_POOL_SIZE) as self.binance, \
+                create_client(TELEGRAM_API_URL, TELEGRAM_POOL_SIZE) as self.telegram:
+            while self.running:
+                started = self.loop.time()
+                if self.paused is None or not self.paused():
+                    try:
+                        await self._tick()
+                    except Exception as e:
+                        print(f"Ошибка асинхронного мониторинга: {e}")
+                await asyncio.sleep(max(0.0, self.interval - (self.loop.time() - started)))
+            if self.pending:
+                await asyncio.gather(*self.pending, return_exceptions=True)
+
+    # Можно ли отправить запрос path к Binance с учетом веса (optional - запрос можно отложить)
+    def _allows(self, path, optional=False):
+        return self.weights is None or self.weights.allows(request_weight(path), optional)
+
+    # Учитывает запрос к Binance до отправки и расход веса по ответу
+    async def _binance_get(self, path, params=None):
+        if self.weights is not None:
+            self.weights.spend(request_weight(path, params))
+        response = await self.binance.get(path, params=params)
+        if self.weights is not None:
+            self.weights.observe(response.status_code, response.headers)
+        return response
+
+    async def _tick(self):
+        # Пока Binance не разрешает запросы или вес минуты исчерпан, тик пропускается целиком
+        if not self._allows("/api/v3/ticker/price"):
+            metrics.jobs_skipped.inc(reason="weight")
+            return
+
+        due = self.feed.due(time.time())
+        if not due:
+            return
+
+        # Текущие цены всех нужных символов одним запросом
+        with metrics.stage_seconds.time(stage="ticker"):
+            prices = await self._get_prices(list(due))
+        self.price_snapshot.update(prices)
+        # Записываются только запрошенные символы, даже если получен весь рынок
+        if self.recorder is not None:
+            self.recorder.record_prices(time.time(), {symbol: prices[symbol] for symbol in due if symbol in prices})
+
+        await asyncio.gather(*(
+            self._process_symbol(symbol, prices[symbol], monitors)
+            for symbol, monitors in due.items() if symbol in prices
+        ))
+
+        # Забываем скользящие средние символов, на которые больше никто не подписан
+        if len(self.moving_averages) > len(due):
+            self.moving_averages.retain(set(self.feed.symbols()))
+
+    async def _process_symbol(self, symbol, price, monitors):
+        now_ms = int(time.time() * 1000)
+        ma_value = self.moving_averages.value(symbol)
+        # Свечи спокойного символа при нехватке веса обновляются реже
+        optional = self.is_calm is not None and self.is_calm(symbol, price)
+        try:
+            with metrics.stage_seconds.time(stage="moving_average"):
+                # Длинная история загружается частями по KLINES_LIMIT свечей
+                while True:
+                    request = self.moving_averages.candles_to_fetch(symbol, now_ms)
+                    if request is None or not self._allows("/api/v3/klines", optional):
+                        break
+                    start_time, limit = request
+                    data = await self._get_klines(symbol, limit, start_time)
+                    if self.recorder is not None:
+                        self.recorder.record_candles(symbol, [item for item in data if item["time"] < now_ms])
+                    ma_value = self.moving_averages.apply(symbol, data, now_ms)
+                    if len(data) < limit:
+                        break
+        except Exception as e:
+            print(f"Ошибка в получении свечей {symbol}: {e}")
+
+        with metrics.stage_seconds.time(stage="evaluate"):
+            messages = self.evaluate_symbol(symbol, price, ma_value, monitors)
+
+        # Отправка не задерживает проверку остальных символов
+        for chat_id, text in messages:
+            if self.outbox is not None:
+                self.outbox.put(chat_id, text)
+                continue
+            task = asyncio.ensure_future(self._send_message(chat_id, text))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def _get_prices(self, symbols):
+        symbols = sorted(set(symbols))
+        params = None
+        if len(symbols) <= TICKER_BATCH_LIMIT:
+            params = {"symbols": json.dumps(symbols, separators=(",", ":"))}
+        try:
+            async with self.semaphore:
+                response = await self._binance_get("/api/v3/ticker/price", params)
+                # Один неизвестный символ отклоняет весь пакет, поэтому в этом случае берем весь рынок
+                if response.status_code == 400 and params is not None:
+                    response = await self._binance_get("/api/v3/ticker/price")
+            response.raise_for_status()
+            return {item["symbol"]: float(item["price"]) for item in response.json()}
+        except Exception as e:
+            metrics.upstream_errors.inc(upstream="binance")
+            print(f"Ошибка в получении цен: {e}")
+            return {}
+
+    async def _get_klines(self, symbol, limit, start_time):
+        params = {"symbol": symbol, "interval": "1m", "limit": limit, "startTime": start_time}
+        try:
+            async with self.semaphore:
+                with metrics.stage_seconds.time(stage="klines"):
+                    response = await self._binance_get("/api/v3/klines", params)
+            response.raise_for_status()
+        except Exception:
+            metrics.upstream_errors.inc(upstream="binance")
+            raise
+        return [{"price": float(candle[4]), "time": int(candle[6])} for candle in response.json()]
+
+    async def _send_message(self, chat_id, text):
+        try:
+            async with self.semaphore:
+                with metrics.stage_seconds.time(stage="send"):
+                    response = await self.telegram.post(f"/bot{TELEGRAM_TOKEN}/sendMessage",
+                                                         data={"chat_id": chat_id, "text": text})
+            response.raise_for_status()
+        except Exception as e:
+            metrics.upstream_errors.inc(upstream="telegram")
+            print(f"Ошибка при отправке уведомления чату {chat_id}: {e}")
+        else:
+            metrics.messages_sent.inc()
+            metrics.alerts_sent.inc()
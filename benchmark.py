@@ -0,0 +1,263 @@
+# Нагрузочный тест бота на локальных заменителях Binance и Telegram (mock_servers.py).
+# Настраивает N чатов через обработчики /set_assets, /set_price_levels и т.д., затем
+# измеряет работу мониторинга и выводит результат в JSON для сравнения версий.
+# Пример: python benchmark.py --chats 500 --symbols 20 --duration 30 --output result.json
+import argparse
+import json
+import multiprocessing
+import resource
+import socket
+import subprocess
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_servers
+
+BENCHMARK_TOKEN = "123456:benchmark"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест мониторинга цен")
+    parser.add_argument("--chats", type=int, default=100, help="число имитируемых чатов")
+    parser.add_argument("--symbols", type=int, default=10, help="число различных пар активов")
+    parser.add_argument("--duration", type=float, default=30, help="длительность измерения в секундах")
+    parser.add_argument("--engine", choices=["jobqueue", "asyncio", "sharded"], default="jobqueue")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов-шардов для --engine sharded")
+    parser.add_argument("--interval", type=int, default=1, help="интервал обновления данных чатов в секундах")
+    parser.add_argument("--alert-timeout", type=int, default=5, help="таймаут уведомлений чатов в секундах")
+    parser.add_argument("--threshold", type=float, default=1, help="порог изменения цены в процентах")
+    parser.add_argument("--levels", type=int, default=1, help="число ценовых уровней на чат")
+    parser.add_argument("--price-path", choices=["step", "random", "flat"], default="step")
+    parser.add_argument("--jump-pct", type=float, default=3.0, help="величина скачка цены в процентах")
+    parser.add_argument("--step-seconds", type=float, default=5.0, help="период скачков цены в секундах")
+    parser.add_argument("--binance-latency-ms", type=float, default=20)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--binance-weight-limit", type=int, default=None,
+                        help="лимит веса запросов Binance в минуту у заменителя и бота (по умолчанию без лимита)")
+    parser.add_argument("--setup-workers", type=int, default=16,
+                        help="число чатов, настраиваемых параллельно (команды одного чата идут по порядку)")
+    parser.add_argument("--telegram-rate", type=float, default=None,
+                        help="лимит сообщений в секунду (по умолчанию из config.py)")
+    parser.add_argument("--output", help="файл для результата в JSON (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def wait_ready(base_url, timeout=10):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return fetch_stats(base_url)
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def diff_counts(before, after):
+    return {key: value - before.get(key, 0) for key, value in after.items() if value - before.get(key, 0)}
+
+
+def cpu_seconds(who=resource.RUSAGE_SELF):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+# Текущий объем резидентной памяти процесса в мегабайтах (только Linux)
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return None
+
+
+# Пары, на которые настраиваются чаты бенчмарка
+def benchmark_pairs(symbols):
+    return tuple((f"B{i}", "USDT") for i in range(symbols))
+
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Создает Update с текстовой командой от имени пользователя chat_id
+def make_update(bot, update_id, chat_id, text):
+    from telegram import Update
+
+    command_length = len(text.split()[0])
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": command_length}],
+        },
+    }, bot)
+
+
+def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    path_options = {"kind": args.price_path, "jump_pct": args.jump_pct, "step_seconds": args.step_seconds}
+    # Заменители работают в отдельном процессе, чтобы их CPU не попадал в измерения
+    mock_process = multiprocessing.Process(
+        target=mock_servers.serve_forever,
+        args=(port, path_options, args.binance_latency_ms / 1000, args.telegram_latency_ms / 1000,
+              args.binance_weight_limit, mock_servers.DEFAULT_PAIRS + benchmark_pairs(args.symbols)),
+        daemon=True,
+    )
+    mock_process.start()
+    try:
+        wait_ready(base_url)
+        return measure(args, base_url)
+    finally:
+        mock_process.terminate()
+        mock_process.join()
+
+
+def measure(args, base_url):
+    # Адреса и токен подменяются до импорта main, так как модули читают config при импорте
+    import config
+    config.BINANCE_API_URL = base_url
+    config.TELEGRAM_API_URL = base_url
+    config.TELEGRAM_TOKEN = BENCHMARK_TOKEN
+    if args.telegram_rate is not None:
+        config.TELEGRAM_GLOBAL_RATE = args.telegram_rate
+    if args.workers is not None:
+        config.SHARD_WORKERS = args.workers
+    if args.binance_weight_limit is not None:
+        config.BINANCE_WEIGHT_LIMIT = args.binance_weight_limit
+    import main
+    from telegram.ext import Updater
+
+    updater = Updater(BENCHMARK_TOKEN, base_url=f"{base_url}/bot")
+    main.register_handlers(updater.dispatcher)
+
+    # Считаем тики общего источника цен и проверки отдельных чатов
+    counters = {"ticks": 0, "checks": 0}
+    original_due = main.feed.due
+
+    def counted_due(now):
+        due = original_due(now)
+        if due:
+            counters["ticks"] += 1
+            counters["checks"] += sum(len(monitors) for monitors in due.values())
+        return due
+
+    main.feed.due = counted_due
+
+    # Настраиваем чаты через обычные обработчики команд
+    levels = " ".join(str(100 + (1 + i) * args.jump_pct / (args.levels + 1)) for i in range(args.levels))
+    commands = [
+        f"/set_alert_timeout {args.alert_timeout}",
+        f"/set_change_threshold {args.threshold}",
+        f"/set_interval {args.interval}",
+        f"/set_price_levels {levels}",
+    ]
+
+    # Справочник пар загружается до настройки чатов, чтобы /set_assets проверял пары по нему
+    main.refresh_symbols()
+
+    def setup_chat(chat_id):
+        chat_commands = commands + [f"/set_assets B{chat_id % args.symbols} USDT"]
+        for i, command in enumerate(chat_commands):
+            update_id = chat_id * len(chat_commands) + i
+            updater.dispatcher.process_update(make_update(updater.bot, update_id, chat_id, command))
+        return len(chat_commands)
+
+    before_setup = fetch_stats(base_url)
+    setup_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.setup_workers) as executor:
+        command_count = sum(executor.map(setup_chat, range(1, args.chats + 1)))
+    setup_seconds = time.perf_counter() - setup_started
+    after_setup = fetch_stats(base_url)
+
+    # Измеряем работу мониторинга
+    cpu_started = cpu_seconds()
+    children_cpu_started = cpu_seconds(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    engine = main.start_monitoring(updater, args.engine)
+    if args.engine == "jobqueue":
+        updater.job_queue.start()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    cpu_used = cpu_seconds() - cpu_started
+    after_run = fetch_stats(base_url)
+
+    if args.engine == "sharded":
+        # Шарды проверяют чаты в своих процессах и сообщают итоги каждого тика
+        counters = {"ticks": engine.ticks / config.SHARD_WORKERS, "checks": engine.checks}
+        engine.stop()
+        # CPU завершившихся процессов-шардов (включая их запуск)
+        cpu_used += cpu_seconds(resource.RUSAGE_CHILDREN) - children_cpu_started
+    elif args.engine == "asyncio":
+        engine.stop()
+    else:
+        updater.job_queue.stop()
+    main.outbox.stop()
+
+    latencies = after_run["latencies"][len(after_setup["latencies"]):]
+    return {
+        "version": git_version(),
+        "params": vars(args),
+        "setup": {
+            "seconds": setup_seconds,
+            "commands_per_sec": command_count / setup_seconds if setup_seconds else None,
+            "upstream_requests": diff_counts(before_setup["requests"], after_setup["requests"]),
+        },
+        "run": {
+            "seconds": elapsed,
+            "feed_ticks": counters["ticks"],
+            "feed_ticks_per_sec": counters["ticks"] / elapsed,
+            "monitor_checks": counters["checks"],
+            "monitor_checks_per_sec": counters["checks"] / elapsed,
+            "alerts_delivered": after_run["alerts"] - after_setup["alerts"],
+            "alert_latency_ms": {
+                "count": len(latencies),
+                "p50": percentile([value * 1000 for value in latencies], 50),
+                "p99": percentile([value * 1000 for value in latencies], 99),
+                "max": max(latencies) * 1000 if latencies else None,
+            },
+            "upstream_requests": diff_counts(after_setup["requests"], after_run["requests"]),
+            "cpu_seconds": cpu_used,
+            "cpu_percent": cpu_used / elapsed * 100,
+            "rss_mb": rss_mb(),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    result = json.dumps(run(arguments), indent=2, ensure_ascii=False)
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            output.write(result + "\n")
+    else:
+        print(result)
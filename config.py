@@ -1 +1,79 @@
-TELEGRAM_TOKEN = "your_telegram_token"
\ No newline at end of file
+TELEGRAM_TOKEN = "your_telegram_token"
+
+# Период (в секундах), с которым общий источник цен проверяет, чьи мониторы пора обновить
+FEED_INTERVAL = 1
+
+# Возраст (в секундах), после которого цена из общего снимка считается устаревшей: такая цена
+# не показывается в сообщениях и не берется точкой отсчета для ценовых уровней
+SNAPSHOT_MAX_AGE = 10
+
+# Максимальное число символов в одном пакетном запросе цен; при большем числе запрашивается весь рынок
+TICKER_BATCH_LIMIT = 100
+
+# Период (в секундах) обновления справочника торгуемых пар из /api/v3/exchangeInfo (вес запроса 20)
+SYMBOLS_REFRESH_INTERVAL = 3600
+
+# Источник рыночных данных: "polling" - опрос REST API, "stream" - WebSocket с опросом в качестве запасного варианта
+MARKET_DATA_MODE = "polling"
+
+# Адрес WebSocket-потоков Binance
+BINANCE_STREAM_URL = "wss://stream.binance.com:9443/ws"
+
+# Адреса REST API Binance и Bot API Telegram
+BINANCE_API_URL = "https://api.binance.com"
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# Размер пула keep-alive соединений для каждого сервиса
+BINANCE_POOL_SIZE = 10
+TELEGRAM_POOL_SIZE = 10
+
+# Таймауты установления соединения и чтения ответа (в секундах)
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+
+# Число повторов при сетевых ошибках и ответах 5xx и множитель задержки между ними
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.3
+
+# Лимит веса запросов к Binance в минуту на IP, доля лимита, которая остается в запасе,
+# и доля, при остатке меньше которой свечи символов без заметного движения обновляются реже
+BINANCE_WEIGHT_LIMIT = 6000
+BINANCE_WEIGHT_RESERVE = 0.1
+BINANCE_WEIGHT_SCARCE = 0.5
+
+# Движок мониторинга: "jobqueue" - задача JobQueue в пуле потоков, "asyncio" - асинхронный движок на httpx,
+# "sharded" - символы распределяются по SHARD_WORKERS процессам, каждый из которых сам опрашивает свои символы
+MONITOR_ENGINE = "jobqueue"
+
+# Число процессов-шардов в режиме MONITOR_ENGINE = "sharded" (обычно по числу ядер процессора)
+SHARD_WORKERS = 4
+
+# Максимальное число одновременных запросов асинхронного движка
+ENGINE_CONCURRENCY = 100
+
+# Лимиты Telegram: сообщений в секунду на всего бота и минимальный интервал между сообщениями в один чат
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_INTERVAL = 1.0
+
+# Окно (в секундах), в течение которого уведомления одного чата объединяются в одно сообщение
+OUTBOX_COALESCE_WINDOW = 0.5
+
+# Период скользящего среднего в минутах; больше 60 не требует дополнительных запросов на каждом тике
+MA_PERIOD = 60
+
+# Порт и адрес HTTP-сервера метрик в формате Prometheus (None - сервер не запускается)
+METRICS_PORT = None
+METRICS_HOST = "127.0.0.1"
+
+# Идентификаторы чатов администраторов, которым доступна команда /stats
+ADMIN_CHAT_IDS = []
+
+# Файл SQLite с настройками и состоянием мониторов чатов (None - состояние не сохраняется между запусками)
+STORE_PATH = "monitors.sqlite3"
+
+# Период (в секундах) фоновой записи накопленных изменений в хранилище
+STORE_FLUSH_INTERVAL = 5
+
+# Файл для записи полученных цен и свечей, по которому replay.py проверяет настройки уведомлений
+# (None - данные не записываются)
+RECORD_PATH = None
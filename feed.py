@@ -0,0 +1,131 @@
+# Общий источник цен: каждый символ опрашивается один раз за тик,
+# а результат раздается всем чатам, подписанным на этот символ
+import math
+import threading
+
+# Допуск (в секундах), с которым монитор считается готовым к проверке: тики планировщика
+# могут приходить на миллисекунды раньше, и без допуска чат пропускал бы каждый второй тик
+DUE_TOLERANCE = 0.1
+
+
+class PriceFeed:
+    # tick - шаг колеса расписания (в секундах), обычно равен периоду вызова due
+    def __init__(self, tick=1.0):
+        # Блокировка нужна, так как обработчики команд и JobQueue работают в разных потоках
+        self.lock = threading.Lock()
+        # symbol -> {chat_id: monitor}
+        self.subscriptions = {}
+        # chat_id -> symbol, чтобы отписка не требовала перебора всех символов
+        self.chat_symbols = {}
+        # Обработчики вида listener(symbol, added), вызываемые при появлении первого
+        # подписчика символа (added=True) и уходе последнего (added=False)
+        self.listeners = []
+        self.tick = tick
+        # Колесо расписания: номер тика -> {chat_id: monitor}, которые нужно проверить в этот тик.
+        # Тик обходит только свои ячейки, поэтому его стоимость зависит от числа готовых
+        # к проверке чатов, а не от общего числа подписок
+        self.wheel = {}
+        # chat_id -> номер тика, в ячейке которого находится чат
+        self.slots = {}
+        # Номер последнего обработанного тика
+        self.last_tick = None
+
+    # Подписывает чат на символ (повторная подписка заменяет прежние настройки чата)
+    def subscribe(self, monitor):
+        chat_id = monitor["chat_id"]
+        symbol = f"{monitor['base_asset']}{monitor['quote_asset']}"
+        with self.lock:
+            removed = self._remove(chat_id)
+            # Символ, оставшийся без подписчиков после переподписки чата
+            vacated = removed[1] if removed else None
+            added = symbol not in self.subscriptions and vacated != symbol
+            self.subscriptions.setdefault(symbol, {})[chat_id] = monitor
+            self.chat_symbols[chat_id] = symbol
+            self._schedule(monitor, max(self._tick_of(monitor["next_run"]), (self.last_tick or 0) + 1))
+        if vacated is not None and vacated != symbol:
+            self._notify(vacated, False)
+        if added:
+            self._notify(symbol, True)
+
+    # Отписывает чат; возвращает False, если чат не был подписан
+    def unsubscribe(self, chat_id):
+        with self.lock:
+            removed = self._remove(chat_id)
+        if removed and removed[1] is not None:
+            self._notify(removed[1], False)
+        return removed is not None
+
+    # Удаляет чат из подписок; возвращает (monitor, symbol или None, если у символа остались подписчики)
+    def _remove(self, chat_id):
+        symbol = self.chat_symbols.pop(chat_id, None)
+        if symbol is None:
+            return None
+        monitors = self.subscriptions[symbol]
+        monitor = monitors.pop(chat_id)
+        self._unschedule(chat_id)
+        # Символ без подписчиков больше не опрашивается
+        if not monitors:
+            del self.subscriptions[symbol]
+            return monitor, symbol
+        return monitor, None
+
+    def _notify(self, symbol, added):
+        for listener in self.listeners:
+            try:
+                listener(symbol, added)
+            except Exception as e:
+                print(f"Ошибка обработчика подписки на {symbol}: {e}")
+
+    def get(self, chat_id):
+        with self.lock:
+            symbol = self.chat_symbols.get(chat_id)
+            return self.subscriptions[symbol][chat_id] if symbol else None
+
+    # Возвращает копию списка мониторов, подписанных на символ
+    def subscribers(self, symbol):
+        with self.lock:
+            return list(self.subscriptions.get(symbol, {}).values())
+
+    def symbols(self):
+        with self.lock:
+            return list(self.subscriptions)
+
+    # Номер тика, в который наступает момент timestamp
+    def _tick_of(self, timestamp):
+        return math.floor(timestamp / self.tick)
+
+    # Помещает монитор в ячейку колеса с номером tick и запоминает время следующей проверки
+    def _schedule(self, monitor, tick):
+        chat_id = monitor["chat_id"]
+        self.wheel.setdefault(tick, {})[chat_id] = monitor
+        self.slots[chat_id] = tick
+        monitor["next_run"] = tick * self.tick
+
+    def _unschedule(self, chat_id):
+        tick = self.slots.pop(chat_id, None)
+        if tick is None:
+            return
+        slot = self.wheel[tick]
+        del slot[chat_id]
+        if not slot:
+            del self.wheel[tick]
+
+    # Возвращает {symbol: [monitor, ...]} для чатов, у которых наступило время проверки.
+    # Если тики были пропущены (например, предыдущая проверка затянулась), чаты из всех
+    # пропущенных ячеек проверяются один раз, а следующая проверка отсчитывается от текущего тика
+    def due(self, now):
+        result = {}
+        with self.lock:
+            current = self._tick_of(now + DUE_TOLERANCE)
+            if self.last_tick is not None and current - self.last_tick <= len(self.wheel):
+                ticks = [tick for tick in range(self.last_tick + 1, current + 1) if tick in self.wheel]
+            else:
+                ticks = [tick for tick in self.wheel if tick <= current]
+            self.last_tick = current if self.last_tick is None else max(self.last_tick, current)
+            for tick in ticks:
+                for chat_id, monitor in self.wheel.pop(tick).items():
+                    # Интервал чата в тиках; чат снова попадает в колесо через столько тиков
+                    steps = max(1, round(monitor["interval"] / self.tick))
+                    self._schedule(monitor, current + steps)
+                    result.setdefault(self.chat_symbols[chat_id], []).append(monitor)
+        return result
@@ -0,0 +1,72 @@
+# Кэш закрытых минутных свечей по символам. Закрытые свечи не меняются, поэтому
+# при обновлении запрашиваются только свечи новее последней сохраненной (startTime)
+from collections import deque
+
+# Длительность минутной свечи в миллисекундах
+CANDLE_MS = 60 * 1000
+
+# Максимальное число свечей в одном ответе /api/v3/klines
+KLINES_LIMIT = 1000
+
+
+class KlineCache:
+    def __init__(self, capacity):
+        # Сколько последних закрытых свечей хранить для каждого символа
+        self.capacity = capacity
+        # symbol -> deque закрытых свечей вида {"price": ..., "time": ...} по возрастанию времени
+        self.candles = {}
+
+    def get(self, symbol):
+        return self.candles.get(symbol)
+
+    # Время закрытия последней сохраненной свечи символа или None
+    def last_time(self, symbol):
+        candles = self.candles.get(symbol)
+        return candles[-1]["time"] if candles else None
+
+    # Параметры следующего запроса свечей: (startTime, limit) или None, если новых закрытых свечей нет
+    def request(self, symbol, now_ms):
+        last_time = self.last_time(symbol)
+        # Время открытия текущей, еще не закрытой свечи
+        current_open = now_ms // CANDLE_MS * CANDLE_MS
+        if last_time is None or last_time + 1 <= current_open - self.capacity * CANDLE_MS:
+            # Кэш пуст или разрыв больше емкости: загружаем всю историю заново
+            start_time = current_open - self.capacity * CANDLE_MS
+        elif last_time + 1 < current_open:
+            start_time = last_time + 1
+        else:
+            return None
+        missed = (current_open - start_time) // CANDLE_MS
+        # Плюс одна свеча - текущая незакрытая, она отбрасывается при добавлении
+        return start_time, min(missed + 1, KLINES_LIMIT)
+
+    # Добавляет загруженные свечи, пропуская незакрытые и уже сохраненные;
+    # возвращает (список новых закрытых свечей, был ли разрыв между ними и сохраненными)
+    def add(self, symbol, data, now_ms):
+        candles = self.candles.get(symbol)
+        if candles is None:
+            candles = self.candles[symbol] = deque(maxlen=self.capacity)
+        last_time = candles[-1]["time"] if candles else None
+        added = [item for item in data if item["time"] < now_ms and (last_time is None or item["time"] > last_time)]
+        gap = bool(added) and last_time is not None and added[0]["time"] - last_time > CANDLE_MS
+        # Свечи, пропущенные самой биржей (например, на время технических работ), уже не появятся:
+        # окно сохраняется, и среднее считается по последним capacity свечам, которые вернул Binance
+        candles.extend(added)
+        return added, gap
+
+    # Добавляет одну закрытую свечу; возвращает False, если она не продолжает кэш без разрыва
+    def append(self, symbol, price, close_time):
+        candles = self.candles.get(symbol)
+        if not candles or close_time != candles[-1]["time"] + CANDLE_MS:
+            return False
+        candles.append({"price": price, "time": close_time})
+        return True
+
+    def discard(self, symbol):
+        self.candles.pop(symbol, None)
+
+    # Оставляет в кэше только указанные символы
+    def retain(self, symbols):
+        for symbol in list(self.candles):
+            if symbol not in symbols:
+                del self.candles[symbol]
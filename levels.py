@@ -0,0 +1,140 @@
+# Отсортированный индекс ценовых уровней всех чатов по символам:
+# пересечения за тик находятся двумя бинарными поисками
+import threading
+from bisect import bisect_left, bisect_right
+from itertools import count
+from operator import itemgetter
+
+
+class PriceLevelIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # symbol -> отсортированный список уровней и параллельный ему список владельцев (chat_id, token)
+        self.prices = {}
+        self.owners = {}
+        # symbol -> число записей удаленных чатов, еще не убранных из списков
+        self.dead = {}
+        # symbol -> последняя цена, от которой отсчитывается следующее пересечение
+        self.last_prices = {}
+        # chat_id -> symbol, на котором у чата заданы уровни, и число еще не достигнутых уровней
+        self.chat_symbols = {}
+        self.chat_counts = {}
+        # chat_id -> токен текущих уровней чата; записи с другим токеном остались от прежних уровней
+        self.chat_tokens = {}
+        self.tokens = count()
+
+    # Заменяет уровни чата; current_price задает начальную цену символа, если она еще не известна
+    def set_levels(self, chat_id, symbol, levels, current_price=None):
+        with self.lock:
+            self._remove_chat(chat_id)
+            if not levels:
+                return
+            owner = self._add_chat(chat_id, symbol, len(levels), current_price)
+            prices = self.prices.setdefault(symbol, [])
+            owners = self.owners.setdefault(symbol, [])
+            self.dead.setdefault(symbol, 0)
+            # Вставка каждого уровня на свое место без пересортировки всего символа
+            for level in levels:
+                i = bisect_right(prices, level)
+                prices.insert(i, level)
+                owners.insert(i, owner)
+
+    # Заменяет уровни многих чатов сразу (например, при восстановлении из хранилища): новые записи
+    # дописываются в конец, и каждый затронутый символ упорядочивается одной сортировкой;
+    # items - [(chat_id, symbol, levels, current_price)]
+    def set_many(self, items):
+        with self.lock:
+            touched = set()
+            for chat_id, symbol, levels, current_price in items:
+                self._remove_chat(chat_id)
+                if not levels:
+                    continue
+                owner = self._add_chat(chat_id, symbol, len(levels), current_price)
+                self.prices.setdefault(symbol, []).extend(levels)
+                self.owners.setdefault(symbol, []).extend([owner] * len(levels))
+                self.dead.setdefault(symbol, 0)
+                touched.add(symbol)
+            for symbol in touched:
+                if symbol in self.prices:
+                    entries = sorted(zip(self.prices[symbol], self.owners[symbol]), key=itemgetter(0))
+                    self.prices[symbol] = [price for price, _ in entries]
+                    self.owners[symbol] = [owner for _, owner in entries]
+
+    def remove_chat(self, chat_id):
+        with self.lock:
+            self._remove_chat(chat_id)
+
+    def _add_chat(self, chat_id, symbol, levels_count, current_price):
+        token = next(self.tokens)
+        self.chat_symbols[chat_id] = symbol
+        self.chat_counts[chat_id] = levels_count
+        self.chat_tokens[chat_id] = token
+        if current_price is not None:
+            self.last_prices.setdefault(symbol, current_price)
+        return chat_id, token
+
+    def _live(self, owner):
+        return self.chat_tokens.get(owner[0]) == owner[1]
+
+    # Записи удаленного чата не ищутся в списках, а помечаются устаревшими по токену
+    # и убираются, когда их становится больше, чем действующих
+    def _remove_chat(self, chat_id):
+        symbol = self.chat_symbols.pop(chat_id, None)
+        if symbol is None:
+            return
+        del self.chat_tokens[chat_id]
+        self.dead[symbol] += self.chat_counts.pop(chat_id)
+        self._maybe_compact(symbol)
+
+    def _maybe_compact(self, symbol):
+        if self.dead[symbol] == len(self.prices[symbol]):
+            # Символ без уровней больше не отслеживается индексом
+            del self.prices[symbol]
+            del self.owners[symbol]
+            del self.dead[symbol]
+            self.last_prices.pop(symbol, None)
+        elif 2 * self.dead[symbol] > len(self.prices[symbol]):
+            self._compact(symbol)
+
+    def _compact(self, symbol):
+        entries = [(price, owner) for price, owner in zip(self.prices[symbol], self.owners[symbol])
+                   if self._live(owner)]
+        self.prices[symbol] = [price for price, _ in entries]
+        self.owners[symbol] = [owner for _, owner in entries]
+        self.dead[symbol] = 0
+
+    # Принимает новую цену символа и атомарно извлекает все уровни, пересеченные
+    # с момента предыдущей цены; возвращает список (уровень, chat_id)
+    def update(self, symbol, price):
+        with self.lock:
+            prices = self.prices.get(symbol)
+            if prices is None:
+                return []
+            previous_price = self.last_prices.get(symbol)
+            self.last_prices[symbol] = price
+            if previous_price is None:
+                return []
+            low, high = min(previous_price, price), max(previous_price, price)
+            i = bisect_left(prices, low)
+            j = bisect_right(prices, high)
+            if i == j:
+                return []
+            owners = self.owners[symbol]
+            crossed = list(zip(prices[i:j], owners[i:j]))
+            del prices[i:j]
+            del owners[i:j]
+            hits = []
+            for level, owner in crossed:
+                if not self._live(owner):
+                    self.dead[symbol] -= 1
+                    continue
+                chat_id = owner[0]
+                hits.append((level, chat_id))
+                # Чаты, у которых сработали все уровни, убираем из индекса
+                self.chat_counts[chat_id] -= 1
+                if not self.chat_counts[chat_id]:
+                    del self.chat_counts[chat_id]
+                    del self.chat_symbols[chat_id]
+                    del self.chat_tokens[chat_id]
+            self._maybe_compact(symbol)
+            return hits
@@ -1,22 +1,78 @@
 # Импорт необходимых библиотек
-import requests  # Для выполнения HTTP-запросов к API
+import requests  # Для обработки ошибок HTTP-запросов к API
 import pandas as pd  # Для работы с данными в виде таблиц (DataFrame)
 import time  # Для работы с временем отправки уведомлений
+import json  # Для передачи списка символов в пакетном запросе цен
+import random  # Для разнесения первых проверок восстановленных чатов во времени
 from telegram import Update, Bot, ReplyKeyboardMarkup  # Компоненты из библиотеки python-telegram-bot
 from telegram.ext import Updater, CommandHandler, CallbackContext, CallbackQueryHandler, MessageHandler, Filters
-from config import TELEGRAM_TOKEN  # Telegram-токен для работы с ботом
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES  # События пропуска задач JobQueue
+from config import TELEGRAM_TOKEN, FEED_INTERVAL, TICKER_BATCH_LIMIT, MARKET_DATA_MODE, BINANCE_STREAM_URL, \
+    TELEGRAM_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, MONITOR_ENGINE, TELEGRAM_GLOBAL_RATE, \
+    TELEGRAM_CHAT_INTERVAL, OUTBOX_COALESCE_WINDOW, MA_PERIOD, METRICS_PORT, METRICS_HOST, \
+    ADMIN_CHAT_IDS, STORE_PATH, STORE_FLUSH_INTERVAL, SHARD_WORKERS, RECORD_PATH, \
+    SYMBOLS_REFRESH_INTERVAL  # Telegram-токен и настройки работы
+from sessions import binance_get, telegram_post, binance_weights  # Общие пулы соединений с Binance и Telegram
+from weights import request_weight, RateLimited  # Вес запросов к Binance
+from feed import PriceFeed  # Общий источник цен для всех чатов
+from rolling import MovingAverages  # Инкрементальные скользящие средние на кэше свечей
+from stream import MarketStream  # Потоковый режим через WebSocket
+from levels import PriceLevelIndex  # Отсортированный индекс ценовых уровней
+from alerts import AlertIndex  # Состояние уведомлений подписчиков в массивах NumPy
+from async_engine import AsyncMonitorEngine  # Асинхронный движок мониторинга
+from outbox import Outbox  # Очередь исходящих уведомлений
+import metrics  # Метрики длительности этапов и счетчики ошибок
+from store import MonitorStore  # Сохранение мониторов чатов между перезапусками
+from shards import ShardPool  # Многопроцессный режим мониторинга
+from recorder import Recorder  # Запись рыночных данных для replay.py
+from symbols import SymbolIndex  # Справочник торгуемых пар Binance
+from snapshot import PriceSnapshot  # Последние цены с временем получения
 
 bot_token = TELEGRAM_TOKEN
 
+# Подписки чатов на символы; цены каждого символа запрашиваются один раз за тик
+feed = PriceFeed(FEED_INTERVAL)
+
+# Ценовые уровни всех чатов, отсортированные по символам
+price_levels_index = PriceLevelIndex()
+
+# Пороги, таймауты и время последних уведомлений подписчиков по символам
+alert_index = AlertIndex()
+
+# Последние полученные цены по всем символам; устаревшие цены не выдаются
+price_snapshot = PriceSnapshot()
+
+# Торгуемые пары Binance для проверки /set_assets; обновляется раз в SYMBOLS_REFRESH_INTERVAL секунд
+symbol_index = SymbolIndex()
+
+# Скользящие средние по закрытым минутным свечам
+moving_averages = MovingAverages(MA_PERIOD)
+
+# Поток рыночных данных в режиме MARKET_DATA_MODE = "stream" (в режиме опроса - None)
+stream = None
+
+# Хранилище мониторов в SQLite; открывается в run_bot (None - состояние не сохраняется)
+store = None
+
+# Процессы-шарды в режиме MONITOR_ENGINE = "sharded" (в остальных режимах - None)
+shards = None
+
+# Запись полученных цен и свечей в файл RECORD_PATH (None - данные не записываются)
+recorder = None
+
 
 # Функция для получения исторических данных цен указанного актива (symbol)
-def get_data(symbol):
-    # URL для запроса свечных данных на спотовом рынке
-    url = "https://api.binance.com/api/v3/klines"
-    # Задаем параметры для запроса: символ актива и интервал свечей (1 минута)
-    params = {"symbol": symbol, "interval": "1m", "limit": 61}
-    # Выполняем запрос и преобразуем ответ в JSON
-    response = requests.get(url, params=params).json()
+def get_data(symbol, limit=61, start_time=None):
+    # Задаем параметры для запроса: символ актива, интервал свечей (1 минута) и их количество
+    params = {"symbol": symbol, "interval": "1m", "limit": limit}
+    # При заданном start_time загружаются только свечи, открытые начиная с этого времени
+    if start_time is not None:
+        params["startTime"] = start_time
+    # Выполняем запрос свечных данных на спотовом рынке и преобразуем ответ в JSON
+    with metrics.stage_seconds.time(stage="klines"):
+        response = binance_get("/api/v3/klines", params)
+    response.raise_for_status()
+    response = response.json()
     # Создаем пустой список для хранения данных
     data = []
     # Обходим все свечи в ответе
@@ -39,11 +95,41 @@ def moving_average(data, period):
     return df["ma"].tolist()
 
 
-# Функция отправки сообщений
+# Возвращает скользящее среднее по последним закрытым свечам символа,
+# загружая только свечи, закрывшиеся с прошлого обновления. optional=True - при нехватке
+# веса запросов обновление откладывается и возвращается прежнее значение
+def get_moving_average(symbol, optional=False):
+    now_ms = int(time.time() * 1000)
+    # Длинная история загружается частями по KLINES_LIMIT свечей
+    while True:
+        request = moving_averages.candles_to_fetch(symbol, now_ms)
+        if request is None:
+            return moving_averages.value(symbol)
+        if not binance_weights.allows(request_weight("/api/v3/klines"), optional):
+            return moving_averages.value(symbol)
+        start_time, limit = request
+        data = get_data(symbol, limit, start_time)
+        if recorder is not None:
+            recorder.record_candles(symbol, [item for item in data if item["time"] < now_ms])
+        ma_value = moving_averages.apply(symbol, data, now_ms)
+        if len(data) < limit:
+            return ma_value
+
+
+# Функция отправки сообщений; возвращает retry_after, если Telegram ограничил частоту отправки
 def send_message(chat_id, text):
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     data = {"chat_id": chat_id, "text": text}
-    requests.post(url, data=data)
+    with metrics.stage_seconds.time(stage="send"):
+        response = telegram_post("sendMessage", data)
+    if response.status_code == 429:
+        return response.json().get("parameters", {}).get("retry_after", 1)
+    response.raise_for_status()
+    return None
+
+
+# Уведомления отправляются в фоне, чтобы проверка цен не ждала Telegram
+outbox = Outbox(send_message, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_INTERVAL, OUTBOX_COALESCE_WINDOW,
+                workers=TELEGRAM_POOL_SIZE)
 
 
 # Функция для формирования уведомления об изменении цены
@@ -61,11 +147,12 @@ def alert(change, base_asset, quote_asset, base_price):
 # Функция обработчика команды /settings
 def settings(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
-    interval = context.user_data.get("interval", 3)
-    alert_timeout = context.user_data.get("alert_timeout", 300)
-    change_threshold = context.user_data.get("change_threshold", 1)
-    base_asset = context.user_data.get("base_asset", "ETH")
-    quote_asset = context.user_data.get("quote_asset", "USDT")
+    interval = context.chat_data.get("interval", 3)
+    alert_timeout = context.chat_data.get("alert_timeout", 300)
+    change_threshold = context.chat_data.get("change_threshold", 1)
+    base_asset = context.chat_data.get("base_asset", "ETH")
+    quote_asset = context.chat_data.get("quote_asset", "USDT")
+    base_price = snapshot_price(base_asset, quote_asset)
     message_id = update.effective_message.message_id
     # Создаем кнопки для настроек
     settings_keyboard = [
@@ -78,11 +165,12 @@ def settings(update: Update, context: CallbackContext):
     # Создаем клавиатуру с кнопками
     reply_markup = ReplyKeyboardMarkup(settings_keyboard, one_time_keyboard=True, resize_keyboard=True)
 
-    price_levels = " ".join(map(str, context.user_data.get("price_levels", [])))
+    price_levels = " ".join(map(str, context.chat_data.get("price_levels", [])))
 
     current_settings_text = (
         "🔧 *Здесь вы можете изменить настройки уведомлений о ценах активов. Текущие настройки:*\n\n"
         f"*Отслеживаемая пара активов: {base_asset}/{quote_asset}*\n"
+        f"Текущая цена: {format_snapshot_price(base_price)}\n"
         f"Порог изменения цены: {change_threshold}%\n"
         f"Интервал обновления данных: {interval} секунд\n"
         f"Таймаут уведомления: {alert_timeout} секунд\n"
@@ -137,27 +225,121 @@ def help_command(update: Update, context: CallbackContext):
     delete_message(context.bot, chat_id, message_id)
 
 
-def update_price_monitor_job_context(update: Update, context: CallbackContext):
-    chat_id = update.effective_chat.id
+# Формирует состояние монитора чата из настроек чата
+def build_monitor(chat_id, chat_data, previous_price=None):
+    interval = chat_data.get("interval", 3)
+    return {
+        "chat_id": chat_id,
+        "interval": interval,
+        "alert_timeout": chat_data.get("alert_timeout", 300),
+        "change_threshold": chat_data.get("change_threshold", 1),
+        "alert_timestamp": None,
+        "base_asset": chat_data.get("base_asset", "ETH"),
+        "quote_asset": chat_data.get("quote_asset", "USDT"),
+        "price_levels": chat_data.get("price_levels", []),
+        "previous_price": previous_price,
+        "next_run": time.time() + interval,
+    }
+
+
+# Подписывает чат на общий источник цен и заносит его ценовые уровни в индекс
+def subscribe_monitor(monitor, persist=True):
+    symbol = f"{monitor['base_asset']}{monitor['quote_asset']}"
+    feed.subscribe(monitor)
+    alert_index.set_monitor(monitor)
+    # Точкой отсчета пересечений служит только свежая цена: по устаревшей сработали бы уровни,
+    # пересеченные еще до подписки; без нее отсчет начнется с первой полученной цены
+    price_levels_index.set_levels(monitor["chat_id"], symbol, monitor["price_levels"], price_snapshot.get(symbol))
+    if shards is not None:
+        shards.subscribe(monitor)
+    if persist:
+        persist_monitor(monitor)
+
+
+# Подписывает сразу много чатов (например, при восстановлении из хранилища): уровни
+# каждого символа заносятся в индекс одной сортировкой, а не вставкой по одному
+def subscribe_monitors(monitors, persist=True):
+    levels = []
+    for monitor in monitors:
+        symbol = f"{monitor['base_asset']}{monitor['quote_asset']}"
+        feed.subscribe(monitor)
+        alert_index.set_monitor(monitor)
+        levels.append((monitor["chat_id"], symbol, monitor["price_levels"], price_snapshot.get(symbol)))
+        if shards is not None:
+            shards.subscribe(monitor)
+        if persist:
+            persist_monitor(monitor)
+    price_levels_index.set_many(levels)
+
+
+# Отписывает чат от источника цен и удаляет его ценовые уровни из индекса
+def unsubscribe_monitor(chat_id):
+    price_levels_index.remove_chat(chat_id)
+    alert_index.remove_chat(chat_id)
+    monitor = feed.get(chat_id)
+    if monitor is not None and store is not None:
+        store.save(monitor, active=False)
+    if shards is not None:
+        shards.unsubscribe(chat_id)
+    return feed.unsubscribe(chat_id)
+
+
+# Отмечает изменившийся монитор для фоновой записи в хранилище
+def persist_monitor(monitor):
+    if store is not None:
+        store.save(monitor)
+
+
+# Восстанавливает настройки и мониторы чатов из хранилища. Первые проверки разносятся
+# случайным образом на интервал чата, чтобы после перезапуска не было всплеска запросов
+def restore_monitors(dispatcher):
+    now = time.time()
+    monitors = []
+    for record in store.load():
+        chat_id = record["chat_id"]
+        # Настройки принадлежат чату, а не пользователю: в группах команды дают разные участники
+        chat_data = dispatcher.chat_data[chat_id]
+        for key in ("base_asset", "quote_asset", "interval", "alert_timeout", "change_threshold", "price_levels"):
+            chat_data[key] = record[key]
+        if not record["active"]:
+            continue
+        # Сохраненная цена могла устареть за время простоя, поэтому точкой отсчета для ценовых
+        # уровней не служит: subscribe_monitors берет только свежую цену из снимка
+        monitor = build_monitor(chat_id, chat_data, record["previous_price"])
+        monitor["alert_timestamp"] = record["alert_timestamp"]
+        monitor["next_run"] = now + random.uniform(0, monitor["interval"])
+        monitors.append(monitor)
+    subscribe_monitors(monitors, persist=False)
+    return len(monitors)
+
+
+# Применяет изменения состояния чата, сделанные процессом-шардом при проверке цен; monitor -
+# подписка, по которой шард их посчитал (устаревшие подписки отсеивает ShardPool)
+def apply_shard_state(monitor, alert_timestamp, price_levels):
+    monitor["alert_timestamp"] = alert_timestamp
+    # Список уровней общий с chat_data чата, поэтому меняется на месте
+    monitor["price_levels"][:] = price_levels
+    persist_monitor(monitor)
+
+
+# Записывает актуальное состояние всех подписанных чатов и закрывает хранилище
+def close_store():
+    for symbol in feed.symbols():
+        for monitor in feed.subscribers(symbol):
+            # Последняя проверенная цена хранится только в индексе уведомлений
+            previous_price = alert_index.previous_price(monitor["chat_id"])
+            if previous_price is not None:
+                monitor["previous_price"] = previous_price
+            store.save(monitor)
+    store.close()
 
-    # Удаляем старую задачу
-    if 'monitor_job' in context.chat_data:
-        context.chat_data['monitor_job'].schedule_removal()
-        del context.chat_data['monitor_job']
-
-    # Создаем новую задачу с обновленными настройками
-    alert_timeout = context.chat_data.get("alert_timeout", 60)
-    change_threshold = context.chat_data.get("change_threshold", 1)
-    base_asset = context.chat_data.get("base_asset", "ETH")
-    quote_asset = context.chat_data.get("quote_asset", "USDT")
-    price_levels = context.chat_data.get("price_levels", [])
-    interval = context.chat_data.get("interval", 60)
 
-    monitor_job_context = (chat_id, alert_timeout, change_threshold, None, base_asset, quote_asset, price_levels, None)
-    monitor_job = context.job_queue.run_repeating(monitor_prices, interval, context=monitor_job_context)
+def update_price_monitor_job_context(update: Update, context: CallbackContext):
+    chat_id = update.effective_chat.id
 
-    # Сохраняем новую задачу в chat_data
-    context.chat_data['monitor_job'] = monitor_job
+    # Переподписываем чат с обновленными настройками, сохраняя последнюю известную цену
+    previous_price = alert_index.previous_price(chat_id)
+    subscribe_monitor(build_monitor(chat_id, context.chat_data, previous_price))
 
 
 def set_assets(update: Update, context: CallbackContext):
@@ -172,13 +354,17 @@ def set_assets(update: Update, context: CallbackContext):
             update.message.reply_text("Базовый и котируемый активы не могут быть одинаковыми. Пожалуйста, попробуйте снова.")
             return
 
-        # Останавливаем текущую задачу отслеживания цен, если она существует
-        if "price_monitor_job" in context.chat_data:
-            context.chat_data["price_monitor_job"].schedule_removal()
-            del context.chat_data["price_monitor_job"]
+        # Пара проверяется по справочнику в памяти, без запроса к Binance
+        if not symbol_index.known(base_asset, quote_asset):
+            update.message.reply_text(unknown_pair_text(base_asset, quote_asset))
+            delete_message(context.bot, chat_id, message_id)
+            return
+
+        # Останавливаем отслеживание прежней пары активов
+        unsubscribe_monitor(chat_id)
 
-        context.user_data["base_asset"] = base_asset
-        context.user_data["quote_asset"] = quote_asset
+        context.chat_data["base_asset"] = base_asset
+        context.chat_data["quote_asset"] = quote_asset
         update.message.reply_text(f"Отслеживаемая пара активов успешно изменена на {base_asset}/{quote_asset}")
         delete_message(context.bot, chat_id, message_id)
         update_price_monitor_job_context(update, context)
@@ -188,6 +374,30 @@ def set_assets(update: Update, context: CallbackContext):
         delete_message(context.bot, chat_id, message_id)
 
 
+# Сообщение о паре, которой нет среди торгуемых на Binance, с похожими парами
+def unknown_pair_text(base_asset, quote_asset):
+    text = f"Пара {base_asset}/{quote_asset} не торгуется на Binance."
+    suggestions = symbol_index.suggest(base_asset, quote_asset)
+    if suggestions:
+        text += " Возможно, вы имели в виду: " + ", ".join(f"/set_assets {base} {quote}" for base, quote in suggestions)
+    return text
+
+
+# Обновляет справочник торгуемых пар; при ошибке остается прежний справочник
+def refresh_symbols(context: CallbackContext = None):
+    try:
+        # Без наборов разрешений и остановленных пар ответ в несколько раз меньше
+        response = binance_get("/api/v3/exchangeInfo", {"symbolStatus": "TRADING", "showPermissionSets": "false"})
+        response.raise_for_status()
+        return symbol_index.load(response.json())
+    except (requests.exceptions.HTTPError, RateLimited) as e:
+        print(f"Ошибка в получении списка пар: {e}")
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Ошибка разбора списка пар: {e}")
+    except Exception as e:
+        print(f"Неизвестная ошибка: {e}")
+
+
 # Обрабатывает текстовые сообщения
 def text_message_handler(update: Update, context: CallbackContext):
     text = update.message.text
@@ -225,7 +435,7 @@ def set_alert_timeout(update: Update, context: CallbackContext):
     # Изменяет время ожидания между отправкой уведомлений
     try:
         new_timeout = int(context.args[0])
-        context.user_data["alert_timeout"] = new_timeout
+        context.chat_data["alert_timeout"] = new_timeout
         update.message.reply_text(f"Время ожидания уведомления успешно изменено на {new_timeout} секунд")
         delete_message(context.bot, chat_id, message_id)
         update_price_monitor_job_context(update, context)
@@ -241,7 +451,7 @@ def set_interval(update: Update, context: CallbackContext):
     # Изменяет интервал мониторинга цен
     try:
         new_interval = int(context.args[0])
-        context.user_data["interval"] = new_interval
+        context.chat_data["interval"] = new_interval
         update.message.reply_text(f"Интервал мониторинга успешно изменен на {new_interval} секунд")
         delete_message(context.bot, chat_id, message_id)
         update_price_monitor_job_context(update, context)
@@ -258,7 +468,7 @@ def set_threshold(update: Update, context: CallbackContext):
     # Изменяет порог изменения цены, после которого будет отправлено уведомление
     try:
         new_threshold = float(context.args[0])
-        context.user_data["change_threshold"] = new_threshold
+        context.chat_data["change_threshold"] = new_threshold
         update.message.reply_text(f"Порог изменения цены успешно изменен на {new_threshold}%")
         delete_message(context.bot, chat_id, message_id)
         update_price_monitor_job_context(update, context)
@@ -274,7 +484,7 @@ def set_price_levels(update: Update, context: CallbackContext):
 
     try:
         price_levels = [float(price) for price in context.args]
-        context.user_data["price_levels"] = price_levels
+        context.chat_data["price_levels"] = price_levels
         update.message.reply_text(f"Ценовые уровни успешно установлены: {', '.join(map(str, price_levels))}")
         delete_message(context.bot, chat_id, message_id)
         update_price_monitor_job_context(update, context)
@@ -284,75 +494,235 @@ def set_price_levels(update: Update, context: CallbackContext):
         delete_message(context.bot, chat_id, message_id)
 
 
-# Получает текущую цену актива на Binance
-def get_asset_price(asset: str, quote_asset: str = "USDT") -> float:
-    if asset == quote_asset:
-        return 1.0
-
-    url = "https://api.binance.com/api/v3/ticker/price"
-    params = {"symbol": f"{asset}{quote_asset}"}
+# Получает текущие цены сразу для набора символов одним запросом к Binance
+def get_asset_prices(symbols) -> dict:
+    symbols = sorted(set(symbols))
+    # Для большого набора символов запрос всего рынка стоит столько же и не упирается в длину URL
+    params = None
+    if len(symbols) <= TICKER_BATCH_LIMIT:
+        params = {"symbols": json.dumps(symbols, separators=(",", ":"))}
     try:
-        response = requests.get(url, params=params)
+        response = binance_get("/api/v3/ticker/price", params)
+        # Один неизвестный символ отклоняет весь пакет, поэтому в этом случае берем весь рынок
+        if response.status_code == 400 and params is not None:
+            response = binance_get("/api/v3/ticker/price")
         response.raise_for_status()
-        data = response.json()
-        return float(data["price"])
-    except requests.exceptions.HTTPError as e:
-        print(f"Ошибка в получении цены: {e}")
-        return None
-    except ValueError as e:
-        print(f"Ошибка преобразования цены: {e}")
+        prices = {item["symbol"]: float(item["price"]) for item in response.json()}
+    except (requests.exceptions.HTTPError, RateLimited) as e:
+        print(f"Ошибка в получении цен: {e}")
+        return {}
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Ошибка преобразования цен: {e}")
+        return {}
     except Exception as e:
         print(f"Неизвестная ошибка: {e}")
+        return {}
+    # Обновляем общий снимок цен
+    price_snapshot.update(prices)
+    # Записываются только запрошенные символы, даже если получен весь рынок
+    if recorder is not None:
+        recorder.record_prices(time.time(), {symbol: prices[symbol] for symbol in symbols if symbol in prices})
+    return prices
+
+
+# Возвращает последнюю полученную цену пары из общего снимка (None - цены еще нет или она
+# устарела, например, после остановки опроса символа); обработчики команд не обращаются
+# к Binance, а цена новой пары появится после первой проверки монитора
+def snapshot_price(base_asset, quote_asset):
+    if base_asset == quote_asset:
+        return 1.0
+    return price_snapshot.get(f"{base_asset}{quote_asset}")
 
 
-def send_notification(bot, chat_id, base_asset, quote_asset, current_price, reached_price_level):
-    message = f"🔔 Цена {base_asset}{quote_asset} достигла установленного ценового уровня {reached_price_level:.2f}.\n\nТекущая цена: {current_price:.2f} {quote_asset}"
-    bot.send_message(chat_id=chat_id, text=message)
+# Цена из снимка для сообщений с разметкой MarkdownV2 (точки экранирует вызывающий). Цена
+# выводится с фиксированной точкой: str() дает для дешевых активов запись вида 1.234e-05,
+# а знак "-" в MarkdownV2 зарезервирован
+def format_snapshot_price(price):
+    if price is None:
+        return "ожидается"
+    return f"{price:.8f}".rstrip("0").rstrip(".")
 
 
-# Основная функция
-def monitor_prices(context: CallbackContext):
-    chat_id, alert_timeout, change_threshold, alert_timestamp, base_asset, quote_asset, \
-    price_levels, previous_price = context.job.context
+# Функция для формирования уведомления о достижении ценового уровня
+def notification(base_asset, quote_asset, current_price, reached_price_level):
+    message = f"🔔 Цена {base_asset}{quote_asset} достигла установленного ценового уровня {reached_price_level:.2f}.\n\nТекущая цена: {current_price:.2f} {quote_asset}"
+    return message
 
-    # Получаем текущую цену базового актива и актива-котировки
-    base_price = get_asset_price(base_asset, quote_asset)
 
-    # Получаем исторические данные для базового актива и актива-котировки
-    data_base = get_data(f"{base_asset}{quote_asset}")
+# Ставит подготовленные уведомления вида (chat_id, text) в очередь отправки
+def send_messages(messages):
+    for chat_id, text in messages:
+        outbox.put(chat_id, text)
+
+
+# Возвращает уведомления для чатов, чьи ценовые уровни символа пересечены с момента предыдущей цены
+def check_price_levels(symbol, base_price):
+    messages = []
+    for price_level, chat_id in price_levels_index.update(symbol, base_price):
+        monitor = feed.get(chat_id)
+        if monitor is None:
+            continue
+        messages.append((chat_id, notification(monitor["base_asset"], monitor["quote_asset"], base_price,
+                                               reached_price_level=price_level)))
+        # Удаляем уровень из настроек чата, так как он был достигнут
+        if price_level in monitor["price_levels"]:
+            monitor["price_levels"].remove(price_level)
+            persist_monitor(monitor)
+    return messages
+
+
+# Решает, какие уведомления вызывает новая цена символа у его подписчиков; возвращает [(chat_id, text)]
+def evaluate_symbol(symbol, base_price, ma_value, monitors):
+    # Ценовые уровни проверяются по индексу сразу для всех чатов символа
+    messages = check_price_levels(symbol, base_price)
+    if not ma_value or not monitors:
+        return messages
+
+    # Изменение скорректированной цены базового актива относительно скользящего среднего в процентах
+    # одинаково для всех подписчиков символа, а пороги и таймауты проверяются сразу для всех чатов
+    change = (base_price - ma_value) / ma_value * 100
+    current_timestamp = int(time.time())
+    alerted = alert_index.evaluate(symbol, [monitor["chat_id"] for monitor in monitors], change, base_price,
+                                   current_timestamp)
+    if not len(alerted):
+        return messages
 
-    # Вычисляем скользящее среднее для полученных данных базового актива с периодом 60 минут
-    ma_base = moving_average(data_base, 60)
+    text = alert(change, monitors[0]["base_asset"], monitors[0]["quote_asset"], base_price)
+    for i in alerted:
+        monitor = monitors[i]
+        # Обновляем время отправки уведомления
+        monitor["alert_timestamp"] = current_timestamp
+        persist_monitor(monitor)
+        messages.append((monitor["chat_id"], text))
+    return messages
 
-    # Вычисляем изменение скорректированной цены базового актива относительно предыдущего значения скользящего среднего в процентах
-    change = (base_price - ma_base[-2]) / ma_base[-2] * 100
 
-    # Получаем текущее время
-    current_timestamp = int(time.time())
+# Символ спокоен, если цена отклонилась от среднего меньше чем на половину наименьшего порога
+# его подписчиков: устаревшее на несколько минут среднее не изменит решения об уведомлении
+def is_calm(symbol, base_price):
+    ma_value = moving_averages.value(symbol)
+    threshold = alert_index.min_threshold(symbol)
+    if not ma_value or threshold is None:
+        return False
+    return abs(base_price - ma_value) / ma_value * 100 < threshold / 2
 
-    # Если изменение больше change_threshold
-    if abs(change) >= change_threshold:
-        # Проверяем, отправлялось ли уведомление ранее и прошло ли достаточно времени с момента последнего уведомления
-        if alert_timestamp is None or (current_timestamp - alert_timestamp) >= alert_timeout:
-            message = alert(change, base_asset, quote_asset, base_price)
-            if message:
-                send_message(chat_id, message)
-                # Обновляем время отправки уведомления
-                alert_timestamp = current_timestamp
 
-    for price_level in price_levels:
-        if (base_price >= price_level >= previous_price) or (base_price <= price_level <= previous_price):
-            send_notification(context.bot, chat_id, base_asset, quote_asset, base_price,
-                              reached_price_level=price_level)
-            price_levels.remove(price_level)  # Удаляем уровень, так как он был достигнут
+# Пока поток цен подключен, опрос не нужен; при разрыве опрос работает как запасной вариант
+def is_streaming():
+    return stream is not None and stream.connected
 
-            # Обновляем значение price_levels в context.job.context
-            context.job.context = (chat_id, alert_timeout, change_threshold, alert_timestamp, base_asset, quote_asset,
-                                   price_levels, base_price)
 
-    # Обновляем значения в context.job.context
-    context.job.context = (chat_id, alert_timeout, change_threshold, alert_timestamp, base_asset, quote_asset,
-                           price_levels, base_price)
+# Основная функция: опрашивает каждый символ один раз и раздает результат всем подписанным чатам
+def monitor_prices(context: CallbackContext):
+    if is_streaming():
+        return
+
+    # Задержка запуска тика относительно запланированного времени (ожидание в очереди JobQueue)
+    now = time.time()
+    if context is not None and context.job is not None and context.job.next_t is not None:
+        scheduled = context.job.next_t.timestamp() - FEED_INTERVAL
+        metrics.stage_seconds.observe(max(0.0, now - scheduled), stage="queue")
+
+    poll_prices(now)
+
+
+# Проверяет чаты, у которых наступило время проверки, одним запросом цен на все их символы;
+# возвращает число проверенных чатов
+def poll_prices(now):
+    # Пока Binance не разрешает запросы или вес минуты исчерпан, тик пропускается целиком
+    if not binance_weights.allows(request_weight("/api/v3/ticker/price")):
+        metrics.jobs_skipped.inc(reason="weight")
+        return 0
+
+    due = feed.due(now)
+    if not due:
+        return 0
+
+    # Получаем текущие цены всех нужных символов одним запросом
+    with metrics.stage_seconds.time(stage="ticker"):
+        prices = get_asset_prices(due)
+
+    for symbol, monitors in due.items():
+        base_price = prices.get(symbol)
+        if base_price is None:
+            continue
+
+        # Скользящее среднее базового актива по закрытым свечам; свечи спокойного символа
+        # при нехватке веса обновляются реже
+        try:
+            with metrics.stage_seconds.time(stage="moving_average"):
+                ma_value = get_moving_average(symbol, is_calm(symbol, base_price))
+        except Exception as e:
+            print(f"Ошибка в получении свечей {symbol}: {e}")
+            ma_value = None
+
+        with metrics.stage_seconds.time(stage="evaluate"):
+            messages = evaluate_symbol(symbol, base_price, ma_value, monitors)
+        send_messages(messages)
+
+    # Забываем скользящие средние символов, на которые больше никто не подписан
+    if len(moving_averages) > len(due):
+        moving_averages.retain(set(feed.symbols()))
+    return sum(len(monitors) for monitors in due.values())
+
+
+# Новая цена сделки из потока: проверяем уведомления всех чатов, подписанных на символ
+def on_stream_price(symbol, price):
+    price_snapshot.set(symbol, price)
+    if recorder is not None:
+        recorder.record_prices(time.time(), {symbol: price})
+    ma_value = moving_averages.value(symbol)
+    # Для нового символа один раз загружаем свечи через get_data
+    if ma_value is None:
+        ma_value = get_moving_average(symbol)
+    with metrics.stage_seconds.time(stage="evaluate"):
+        messages = evaluate_symbol(symbol, price, ma_value, feed.subscribers(symbol))
+    send_messages(messages)
+
+
+# Закрылась минутная свеча: сдвигаем скользящее среднее
+def on_stream_candle(symbol, price, close_time):
+    if recorder is not None:
+        recorder.record_candles(symbol, [{"price": price, "time": close_time}])
+    last_time = moving_averages.last_time(symbol)
+    if last_time is None:
+        return
+    if not moving_averages.push(symbol, price, close_time) and close_time > last_time:
+        # Между свечами образовался разрыв: догружаем пропущенные свечи через get_data
+        get_moving_average(symbol)
+
+
+# Поток переподключился: догружаем свечи, закрывшиеся за время разрыва
+def on_stream_reconnect(symbols):
+    for symbol in symbols:
+        try:
+            get_moving_average(symbol)
+        except Exception as e:
+            print(f"Не удалось догрузить свечи {symbol}: {e}")
+
+
+# Синхронизирует подписки потока с подписками чатов
+def on_feed_change(symbol, added):
+    if added:
+        stream.subscribe(symbol)
+    else:
+        stream.unsubscribe(symbol)
+        moving_averages.discard(symbol)
+
+
+# Запускает потоковый режим получения рыночных данных
+def start_stream():
+    global stream
+    stream = MarketStream(
+        BINANCE_STREAM_URL,
+        on_price=on_stream_price,
+        on_candle=on_stream_candle,
+        on_reconnect=on_stream_reconnect,
+    )
+    feed.listeners.append(on_feed_change)
+    for symbol in feed.symbols():
+        stream.subscribe(symbol)
+    stream.start()
 
 
 # Функция для удаления сообщений
@@ -367,15 +737,11 @@ def delete_message(bot: Bot, chat_id, message_id):
 # Функция обработчика команды /start
 def start(update: Update, context: CallbackContext):
     chat_id = update.message.chat_id
-    interval = context.user_data.get("interval", 3)
-    alert_timeout = context.user_data.get("alert_timeout", 300)
-    change_threshold = context.user_data.get("change_threshold", 1)
-    base_asset = context.user_data.get("base_asset", "ETH")
-    quote_asset = context.user_data.get("quote_asset", "USDT")
-    base_price = get_asset_price(base_asset, quote_asset)
-    price_levels = context.user_data.get("price_levels", [])
-    previous_price = context.user_data.get("previous_price", base_price)
-    alert_timestamp = 0
+    change_threshold = context.chat_data.get("change_threshold", 1)
+    base_asset = context.chat_data.get("base_asset", "ETH")
+    quote_asset = context.chat_data.get("quote_asset", "USDT")
+    base_price = snapshot_price(base_asset, quote_asset)
+    previous_price = context.chat_data.get("previous_price", base_price)
 
     # Создаем кнопку "Настройки"
     settings_button = [["⚙️ Настройки"]]
@@ -385,7 +751,7 @@ def start(update: Update, context: CallbackContext):
 
     message_id = update.effective_message.message_id
 
-    base_price_markdown = str(base_price).replace('.', r'\.')
+    base_price_markdown = format_snapshot_price(base_price).replace('.', r'\.')
     change_threshold_markdown = str(change_threshold).replace('.', r'\.')
     # Отправляем приветственное сообщение
     update.message.reply_text(
@@ -398,21 +764,20 @@ def start(update: Update, context: CallbackContext):
 
     delete_message(context.bot, chat_id, message_id)
 
-    # Добавление функции monitor_prices в JobQueue
-    context.chat_data['monitor_job'] = context.job_queue.run_repeating(monitor_prices, interval, context=(chat_id, alert_timeout, change_threshold, alert_timestamp, base_asset, quote_asset, price_levels, previous_price))
+    # Подписываем чат на общий источник цен (повторный /start заменяет прежнюю подписку)
+    monitor = build_monitor(chat_id, context.chat_data, previous_price)
+    monitor["alert_timestamp"] = 0
+    subscribe_monitor(monitor)
 
 
 # Функция обработчика команды /stop
 def stop(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
 
-    # Проверяем, есть ли активный Job для данного chat_id
-    current_job = context.job_queue.get_jobs_by_name(str(chat_id))
-
     message_id = update.effective_message.message_id
 
-    if current_job:
-        current_job[0].schedule_removal()  # Отменяем задачу
+    # Отписываем чат от общего источника цен, если он был подписан
+    if unsubscribe_monitor(chat_id):
         update.message.reply_text("Мониторинг цен остановлен.")
     else:
         update.message.reply_text("Мониторинг цен не был запущен.")
@@ -420,31 +785,137 @@ def stop(update: Update, context: CallbackContext):
     delete_message(context.bot, chat_id, message_id)
 
 
+# Функция обработчика команды /stats: сводка метрик, доступная только администраторам
+def stats_command(update: Update, context: CallbackContext):
+    if update.effective_chat.id not in ADMIN_CHAT_IDS:
+        update.message.reply_text("Команда доступна только администраторам.")
+        return
+
+    lines = ["Этапы мониторинга (число, среднее / p50 / p99, мс):"]
+    for (stage,), (count, total) in sorted(metrics.stage_seconds.summary().items()):
+        p50 = metrics.stage_seconds.percentile(50, stage=stage)
+        p99 = metrics.stage_seconds.percentile(99, stage=stage)
+        lines.append(f"{stage}: {count}, {total / count * 1000:.1f} / {p50 * 1000:.1f} / {p99 * 1000:.1f}")
+    lines.append("")
+    lines.append(f"Ошибки запросов: {format_counter(metrics.upstream_errors)}")
+    lines.append(f"Повторы запросов: {format_counter(metrics.upstream_retries)}")
+    lines.append(f"Пропущенные тики: {format_counter(metrics.jobs_skipped)}")
+    lines.append(f"Уведомлений отправлено: {format_counter(metrics.alerts_sent)}")
+    lines.append(f"Сообщений отправлено: {format_counter(metrics.messages_sent)}")
+    lines.append(f"Подписанных чатов: {len(feed.chat_symbols)}, символов: {len(feed.symbols())}")
+    update.message.reply_text("\n".join(lines))
+
+
+# Форматирует значения счетчика для /stats: "binance=3, telegram=1" или одно число
+def format_counter(counter):
+    values = dict(counter.values)
+    if not counter.labelnames:
+        return str(values.get((), 0))
+    if not values:
+        return "0"
+    return ", ".join(f"{'/'.join(key)}={value}" for key, value in sorted(values.items()))
+
+
+# Регистрирует обработчики команд, текстовых сообщений и кнопок в диспетчере
+def register_handlers(dp):
+    # Регистрация обработчиков команд; длительность каждой команды попадает в метрики
+    commands = {
+        "start": start,
+        "set_change_threshold": set_threshold,
+        "set_interval": set_interval,
+        "set_alert_timeout": set_alert_timeout,
+        "help": help_command,
+        "stop": stop,
+        "set_assets": set_assets,
+        "set_price_levels": set_price_levels,
+        "stats": stats_command,
+    }
+    for command, handler in commands.items():
+        dp.add_handler(CommandHandler(command, metrics.timed_command(command, handler)))
+    dp.add_handler(MessageHandler(Filters.text, metrics.timed_command("text", text_message_handler)))
+
+    # Регистрация обработчиков кнопок
+    dp.add_handler(CallbackQueryHandler(metrics.timed_command("button", button_callback)))
+
+
+# Считает тики мониторинга, пропущенные планировщиком или наложившиеся на незавершенный предыдущий тик
+def on_scheduler_event(event):
+    if event.code == EVENT_JOB_MISSED:
+        metrics.jobs_skipped.inc(reason="missed")
+    elif event.code == EVENT_JOB_MAX_INSTANCES:
+        metrics.jobs_skipped.inc(reason="overrun")
+
+
+# Запускает получение цен и отправку уведомлений выбранным движком мониторинга
+def start_monitoring(updater, engine=MONITOR_ENGINE):
+    outbox.start()
+
+    # Шарды сами получают цены своих символов (в том числе через WebSocket), а процесс бота
+    # только принимает команды и отправляет уведомления
+    if engine == "sharded":
+        global shards
+        shards = ShardPool(SHARD_WORKERS, send_messages, apply_shard_state, on_prices=price_snapshot.update)
+        shards.start([monitor for symbol in feed.symbols() for monitor in feed.subscribers(symbol)])
+        return shards
+
+    # В потоковом режиме цены приходят через WebSocket
+    if MARKET_DATA_MODE == "stream":
+        start_stream()
+
+    # Один общий опрос цен для всех подписанных чатов (в потоковом режиме - запасной)
+    if engine == "asyncio":
+        engine = AsyncMonitorEngine(feed, moving_averages, price_snapshot, evaluate_symbol, paused=is_streaming,
+                                    outbox=outbox, recorder=recorder, weights=binance_weights, is_calm=is_calm)
+        engine.start()
+        return engine
+    updater.job_queue.scheduler.add_listener(on_scheduler_event, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+    # Затянувшийся тик не накладывается на следующий и не копит очередь запусков: опоздавшие
+    # запуски объединяются в один, а чаты пропущенных тиков проверяются в нем один раз
+    return updater.job_queue.run_repeating(monitor_prices, FEED_INTERVAL,
+                                           job_kwargs={"max_instances": 1, "coalesce": True})
+
+
 # Функция для запуска бота
 def run_bot():
-    updater = Updater(bot_token)
+    # Соединения самой библиотеки python-telegram-bot тоже берутся из пула с таймаутами
+    updater = Updater(bot_token, request_kwargs={
+        "con_pool_size": TELEGRAM_POOL_SIZE,
+        "connect_timeout": HTTP_CONNECT_TIMEOUT,
+        "read_timeout": HTTP_READ_TIMEOUT,
+    })
 
     # Получаем диспетчер для регистрации обработчиков
-    dp = updater.dispatcher
-
-    # Регистрация обработчиков команд
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("set_change_threshold", set_threshold))
-    dp.add_handler(CommandHandler("set_interval", set_interval))
-    dp.add_handler(CommandHandler("set_alert_timeout", set_alert_timeout))
-    dp.add_handler(CommandHandler("help", help_command))
-    dp.add_handler(CommandHandler("stop", stop))
-    dp.add_handler(CommandHandler("set_assets", set_assets))
-    dp.add_handler(CommandHandler("set_price_levels", set_price_levels))
-    dp.add_handler(MessageHandler(Filters.text, text_message_handler))
+    register_handlers(updater.dispatcher)
 
-    # Регистрация обработчиков кнопок
-    dp.add_handler(CallbackQueryHandler(button_callback))
+    # Полученные цены и свечи дописываются в файл для проверки настроек через replay.py
+    global store, recorder
+    if RECORD_PATH is not None:
+        recorder = Recorder(RECORD_PATH)
+
+    # Восстанавливаем чаты, подписанные до перезапуска
+    if STORE_PATH is not None:
+        store = MonitorStore(STORE_PATH, STORE_FLUSH_INTERVAL)
+        print(f"Восстановлено мониторов: {restore_monitors(updater.dispatcher)}")
+        store.start()
+
+    start_monitoring(updater)
+
+    # Справочник пар загружается в фоне при старте и затем обновляется периодически
+    updater.job_queue.run_repeating(refresh_symbols, SYMBOLS_REFRESH_INTERVAL, first=0)
+
+    # Метрики в формате Prometheus доступны по адресу http://METRICS_HOST:METRICS_PORT/metrics
+    if METRICS_PORT is not None:
+        metrics.start_server(METRICS_PORT, METRICS_HOST)
 
     # Запускаем бот
     updater.start_polling()
     updater.idle()
 
+    if store is not None:
+        close_store()
+    if recorder is not None:
+        recorder.close()
+
 
 # Вызываем функцию run_bot(), при выполнении условия
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+# Метрики работы бота: счетчики и гистограммы длительности этапов с экспортом
+# в текстовом формате Prometheus через локальный HTTP-сервер
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм длительности (в секундах)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        # Кортеж значений меток -> значение счетчика
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # Кортеж значений меток -> [число наблюдений по корзинам (последняя - +Inf), сумма]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][i] += 1
+            counts[1] += value
+
+    # Засекает длительность блока with и записывает ее в гистограмму
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    # Оценка перцентиля по корзинам с линейной интерполяцией внутри корзины
+    def percentile(self, p, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                return None
+            buckets = list(counts[0])
+        total = sum(buckets)
+        rank = p / 100 * total
+        seen = 0
+        for i, count in enumerate(buckets):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    # Возвращает {значения меток: (число наблюдений, сумма)}
+    def summary(self):
+        with self.lock:
+            return {key: (sum(counts), total) for key, (counts, total) in self.values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self.values.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames + ("le",), key + (str(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+# Длительность этапов мониторинга: ticker, klines, moving_average, evaluate, send, queue
+stage_seconds = Histogram("price_alert_stage_seconds", "Duration of monitoring stages", ("stage",))
+# Длительность обработки команд бота
+command_seconds = Histogram("price_alert_command_seconds", "Duration of command handlers", ("command",))
+upstream_errors = Counter("price_alert_upstream_errors_total", "Failed upstream requests", ("upstream",))
+upstream_retries = Counter("price_alert_upstream_retries_total", "Retried upstream requests", ("upstream",))
+# Пропущенные (опоздавшие) и наложившиеся на предыдущий запуск тики мониторинга
+jobs_skipped = Counter("price_alert_jobs_skipped_total", "Monitor ticks skipped by the scheduler", ("reason",))
+alerts_sent = Counter("price_alert_alerts_sent_total", "Alerts delivered to Telegram")
+messages_sent = Counter("price_alert_messages_sent_total", "Telegram messages sent by the outbox")
+
+REGISTRY = [stage_seconds, command_seconds, upstream_errors, upstream_retries, jobs_skipped, alerts_sent,
+            messages_sent]
+
+
+# Оборачивает обработчик команды так, чтобы его длительность попадала в command_seconds
+def timed_command(name, handler):
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        with command_seconds.time(command=name):
+            return handler(*args, **kwargs)
+    return wrapper
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Запускает HTTP-сервер с метриками по адресу http://host:port/metrics; если порт занят,
+# бот работает без сервера метрик (возвращается None)
+def start_server(port, host="127.0.0.1"):
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,336 @@
+# Локальные заменители Binance REST API, WebSocket-потоков Binance и Telegram Bot API для
+# нагрузочных тестов. Цены меняются по заданной траектории; сервер считает запросы и измеряет время
+# от изменения цены до получения уведомления об этом
+import asyncio
+import collections
+import json
+import math
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import tornado.httpserver  # WebSocket-сервер (tornado уже нужен python-telegram-bot)
+import tornado.ioloop
+import tornado.netutil
+import tornado.web
+import tornado.websocket
+
+from weights import request_weight
+
+CANDLE_MS = 60 * 1000
+
+# Уведомления бота начинаются с этих символов; ответы на команды их не содержат
+ALERT_PREFIXES = ("📈", "📉", "🔔")
+
+# Торгуемые пары (base_asset, quote_asset) в ответе exchangeInfo по умолчанию
+DEFAULT_PAIRS = (("ETH", "USDT"), ("BTC", "USDT"))
+
+
+# Траектория цены: base_price, скачками на jump_pct процентов каждые step_seconds ("step"),
+# случайное блуждание ("random") или постоянная цена ("flat")
+class PricePath:
+    def __init__(self, kind="step", base_price=100.0, jump_pct=3.0, step_seconds=5.0, seed=0):
+        self.kind = kind
+        self.base_price = base_price
+        self.jump_pct = jump_pct
+        self.step_seconds = step_seconds
+        self.started = time.time()
+        self.random = random.Random(seed)
+        self.walk = {}
+
+    def price(self, symbol, now):
+        if self.kind == "step":
+            phase = math.floor((now - self.started) / self.step_seconds) % 2
+            return self.base_price * (1 + self.jump_pct / 100) if phase else self.base_price
+        if self.kind == "random":
+            price = self.walk.get(symbol, self.base_price) * (1 + self.random.gauss(0, self.jump_pct / 1000))
+            self.walk[symbol] = price
+            return price
+        return self.base_price
+
+    # Время последнего скачка цены вверх (для траектории "step"), от которого отсчитывается задержка уведомления
+    def last_change(self, now):
+        if self.kind != "step":
+            return None
+        steps = math.floor((now - self.started) / self.step_seconds)
+        if steps % 2 == 0:
+            steps -= 1
+        return self.started + steps * self.step_seconds if steps >= 0 else None
+
+
+class MockState:
+    # weight_limit - лимит веса запросов Binance в минуту (None - без лимита),
+    # pairs - торгуемые пары для exchangeInfo (цены отдаются для любых символов)
+    def __init__(self, path, binance_latency, telegram_latency, weight_limit=None, pairs=DEFAULT_PAIRS):
+        self.path = path
+        self.pairs = pairs
+        self.binance_latency = binance_latency
+        self.telegram_latency = telegram_latency
+        self.weight_limit = weight_limit
+        # Минута и израсходованный в ней вес
+        self.weight_window = None
+        self.used_weight = 0
+        self.lock = threading.Lock()
+        # path -> число запросов
+        self.requests = {}
+        # Задержки уведомлений в секундах и число полученных уведомлений
+        self.latencies = []
+        self.alerts = 0
+        self.message_id = 0
+        # chat_id -> скачок цены, задержка до которого уже учтена
+        self.measured = {}
+
+    def count(self, path):
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    # Учитывает вес запроса; возвращает израсходованный за минуту вес и признак превышения лимита
+    def spend_weight(self, weight, now):
+        with self.lock:
+            window = int(now // 60)
+            if window != self.weight_window:
+                self.weight_window = window
+                self.used_weight = 0
+            self.used_weight += weight
+            return self.used_weight, self.weight_limit is not None and self.used_weight > self.weight_limit
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "alerts": self.alerts, "latencies": list(self.latencies)}
+
+
+def create_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        # Заголовки и тело ответа пишутся отдельно; без TCP_NODELAY каждый ответ
+        # задерживался бы на ~40 мс из-за алгоритма Нейгла
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, payload, status=200, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/stats":
+                return self.reply(state.stats())
+            state.count(url.path)
+            time.sleep(state.binance_latency)
+            now = time.time()
+            used, exceeded = state.spend_weight(request_weight(url.path, query), now)
+            headers = {"X-MBX-USED-WEIGHT-1M": str(used)}
+            if exceeded:
+                state.count("rate_limited")
+                headers["Retry-After"] = str(60 - int(now % 60))
+                return self.reply({"code": -1003, "msg": "Too many requests"}, 429, headers)
+            if url.path == "/api/v3/ticker/price":
+                if "symbol" in query:
+                    symbol = query["symbol"][0]
+                    return self.reply({"symbol": symbol, "price": str(state.path.price(symbol, now))}, headers=headers)
+                # Без списка символов отдается весь рынок - все торгуемые пары
+                symbols = json.loads(query["symbols"][0]) if "symbols" in query else \
+                    [f"{base_asset}{quote_asset}" for base_asset, quote_asset in state.pairs]
+                return self.reply([{"symbol": symbol, "price": str(state.path.price(symbol, now))} for symbol in symbols],
+                                  headers=headers)
+            if url.path == "/api/v3/klines":
+                return self.reply(self.klines(query, now), headers=headers)
+            if url.path == "/api/v3/exchangeInfo":
+                return self.reply({"symbols": [
+                    {"symbol": f"{base_asset}{quote_asset}", "status": "TRADING",
+                     "baseAsset": base_asset, "quoteAsset": quote_asset}
+                    for base_asset, quote_asset in state.pairs
+                ]}, headers=headers)
+            self.reply({"code": -1, "msg": "Unknown path"}, 404, headers)
+
+        # Закрытые свечи с ценой закрытия base_price и текущая незакрытая свеча
+        def klines(self, query, now):
+            limit = int(query.get("limit", ["500"])[0])
+            now_ms = int(now * 1000)
+            current_open = now_ms // CANDLE_MS * CANDLE_MS
+            start = int(query["startTime"][0]) if "startTime" in query else current_open - (limit - 1) * CANDLE_MS
+            start = start // CANDLE_MS * CANDLE_MS
+            candles = []
+            open_time = start
+            while len(candles) < limit and open_time <= current_open:
+                close = str(state.path.base_price)
+                candles.append([open_time, close, close, close, close, "0", open_time + CANDLE_MS - 1])
+                open_time += CANDLE_MS
+            return candles
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode()
+            method = url.path.rsplit("/", 1)[-1]
+            state.count(f"telegram/{method}")
+            received = time.time()
+            time.sleep(state.telegram_latency)
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                data = json.loads(body or "{}")
+            else:
+                data = {key: values[0] for key, values in parse_qs(body).items()}
+            if method == "sendMessage":
+                chat_id = int(data.get("chat_id", 0))
+                self.record_alert(chat_id, str(data.get("text", "")), received)
+                with state.lock:
+                    state.message_id += 1
+                    message_id = state.message_id
+                return self.reply({"ok": True, "result": {
+                    "message_id": message_id, "date": int(received),
+                    "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+                }})
+            if method == "getMe":
+                return self.reply({"ok": True, "result": {
+                    "id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot",
+                }})
+            self.reply({"ok": True, "result": True})
+
+        # Считает уведомление; для первого уведомления о росте после скачка цены запоминает задержку
+        def record_alert(self, chat_id, text, received):
+            if not text.startswith(ALERT_PREFIXES):
+                return
+            changed = state.path.last_change(received)
+            with state.lock:
+                state.alerts += 1
+                if changed is not None and "📈" in text and state.measured.get(chat_id) != changed:
+                    state.measured[chat_id] = changed
+                    state.latencies.append(received - changed)
+
+    return Handler
+
+
+# Запускает сервер в отдельном потоке и возвращает его; порт 0 выбирает свободный порт
+def serve(port=0, path=None, binance_latency=0.0, telegram_latency=0.0, weight_limit=None, pairs=DEFAULT_PAIRS):
+    state = MockState(path or PricePath(), binance_latency, telegram_latency, weight_limit, pairs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="mock-servers", daemon=True).start()
+    return server
+
+
+# Точка входа для запуска заменителей в отдельном процессе
+def serve_forever(port, path_options, binance_latency, telegram_latency, weight_limit=None, pairs=DEFAULT_PAIRS):
+    serve(port, PricePath(**path_options), binance_latency, telegram_latency, weight_limit, pairs)
+    while True:
+        time.sleep(3600)
+
+
+# Заменитель WebSocket-потоков Binance (адрес вида ws://127.0.0.1:port/ws): принимает
+# SUBSCRIBE/UNSUBSCRIBE, рассылает события сделок и свечей подписанным соединениям
+# и может разорвать все соединения, чтобы проверить переподключение клиента
+class StreamServer:
+    def __init__(self, port=0, max_streams=1024):
+        self.port = port
+        # Ограничения Binance на соединение: число потоков и входящих сообщений в секунду
+        self.max_streams = max_streams
+        self.max_messages = 5
+        self.loop = None
+        self.server = None
+        # Открытые соединения; у каждого - множество подписанных потоков (streams)
+        self.connections = set()
+        # Число принятых соединений и соединений, разорванных за превышение лимитов
+        self.opened = 0
+        self.rejected = 0
+        self.ready = threading.Event()
+        threading.Thread(target=self._run, name="mock-stream", daemon=True).start()
+        self.ready.wait()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.port}/ws"
+
+    def _run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        sockets = tornado.netutil.bind_sockets(self.port, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        self.server = tornado.httpserver.HTTPServer(tornado.web.Application([
+            (r"/ws", StreamHandler, {"stream_server": self}),
+        ]))
+        self.server.add_sockets(sockets)
+        self.loop = tornado.ioloop.IOLoop.current()
+        self.ready.set()
+        self.loop.start()
+
+    # Потоки, на которые подписаны открытые соединения
+    def subscriptions(self):
+        return set().union(*(connection.streams for connection in list(self.connections)))
+
+    def send_trade(self, symbol, price):
+        self._broadcast(f"{symbol.lower()}@trade", {"e": "trade", "s": symbol, "p": str(price)})
+
+    # Свеча с ценой закрытия close_price и временем закрытия close_time (в миллисекундах)
+    def send_kline(self, symbol, close_price, close_time, closed=True):
+        self._broadcast(f"{symbol.lower()}@kline_1m", {
+            "e": "kline", "s": symbol, "k": {"c": str(close_price), "T": close_time, "x": closed},
+        })
+
+    def _broadcast(self, stream, event):
+        message = json.dumps(event)
+        self.loop.add_callback(lambda: [connection.write_message(message)
+                                        for connection in list(self.connections) if stream in connection.streams])
+
+    # Разрывает все открытые соединения
+    def drop(self):
+        self.loop.add_callback(lambda: [connection.close() for connection in list(self.connections)])
+
+    def stop(self):
+        self.drop()
+        self.loop.add_callback(self.server.stop)
+        self.loop.add_callback(self.loop.stop)
+
+
+class StreamHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, stream_server):
+        self.stream_server = stream_server
+        self.streams = set()
+        # Время последних входящих сообщений для проверки лимита частоты
+        self.received = collections.deque()
+
+    def check_origin(self, origin):
+        return True
+
+    def open(self):
+        self.stream_server.opened += 1
+        self.stream_server.connections.add(self)
+
+    # Запросы вида {"method": "SUBSCRIBE", "params": [...], "id": 1}; ответ как у Binance
+    def on_message(self, message):
+        now = time.monotonic()
+        self.received.append(now)
+        while self.received[0] <= now - 1:
+            self.received.popleft()
+        # Как и Binance, разрываем соединение, превысившее лимит сообщений в секунду
+        if len(self.received) > self.stream_server.max_messages:
+            self.stream_server.rejected += 1
+            self.close()
+            return
+        request = json.loads(message)
+        if request["method"] == "SUBSCRIBE":
+            if len(self.streams | set(request["params"])) > self.stream_server.max_streams:
+                self.write_message(json.dumps({"error": {"code": 2, "msg": "Too many streams"},
+                                               "id": request["id"]}))
+                return
+            self.streams.update(request["params"])
+        elif request["method"] == "UNSUBSCRIBE":
+            self.streams.difference_update(request["params"])
+        self.write_message(json.dumps({"result": None, "id": request["id"]}))
+
+    def on_close(self):
+        self.stream_server.connections.discard(self)
@@ -0,0 +1,133 @@
+# Очередь исходящих уведомлений Telegram с фоновой отправкой: соблюдает общий лимит бота
+# и лимит на каждый чат, учитывает retry_after и объединяет уведомления одного чата
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+class Outbox:
+    # send(chat_id, text) отправляет сообщение и возвращает retry_after в секундах,
+    # если Telegram попросил подождать, иначе None
+    def __init__(self, send, global_rate, chat_interval, coalesce_window, workers=4):
+        self.send = send
+        # Не больше global_rate сообщений в секунду на всего бота
+        self.global_rate = global_rate
+        # Не чаще одного сообщения в chat_interval секунд в один чат
+        self.chat_interval = chat_interval
+        # Сколько ждать после первого уведомления чата, собирая остальные в одно сообщение
+        self.coalesce_window = coalesce_window
+        self.condition = threading.Condition()
+        # chat_id -> список текстов, ожидающих отправки
+        self.pending = {}
+        # chat_id -> время постановки в очередь первого неотправленного текста
+        self.queued_at = {}
+        # chat_id -> время, раньше которого в чат нельзя отправлять
+        self.next_allowed = {}
+        # Чаты, сообщение в которые сейчас отправляется
+        self.in_flight = set()
+        # Время отправки сообщений за последнюю секунду
+        self.sent_times = deque()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox")
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    # Ставит уведомление в очередь и сразу возвращает управление
+    def put(self, chat_id, text):
+        with self.condition:
+            if chat_id not in self.pending:
+                self.pending[chat_id] = []
+                self.queued_at[chat_id] = time.monotonic()
+            self.pending[chat_id].append(text)
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                batch, wait = self._take_ready(time.monotonic())
+                if not batch:
+                    self.condition.wait(wait)
+                    continue
+            for chat_id, text, count in batch:
+                self.executor.submit(self._deliver, chat_id, text, count)
+
+    # Выбирает чаты, которым можно отправить сообщение сейчас; возвращает
+    # [(chat_id, text, число объединенных уведомлений)] и время ожидания до следующей возможной отправки
+    def _take_ready(self, now):
+        while self.sent_times and now - self.sent_times[0] >= 1:
+            self.sent_times.popleft()
+        # Забываем ограничения чатов, которые уже истекли
+        if len(self.next_allowed) > len(self.pending) + 1000:
+            self.next_allowed = {chat_id: at for chat_id, at in self.next_allowed.items() if at > now}
+        budget = self.global_rate - len(self.sent_times)
+        wait = None
+        if budget <= 0:
+            wait = 1 - (now - self.sent_times[0])
+        batch = []
+        for chat_id in list(self.pending):
+            if chat_id in self.in_flight:
+                continue
+            ready_at = max(self.queued_at[chat_id] + self.coalesce_window, self.next_allowed.get(chat_id, 0))
+            if ready_at > now or budget <= 0:
+                delay = max(ready_at - now, 0) if budget > 0 else wait
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            batch.append((chat_id, *self._take_text(chat_id)))
+            self.in_flight.add(chat_id)
+            self.next_allowed[chat_id] = now + self.chat_interval
+            self.sent_times.append(now)
+            budget -= 1
+        return batch, wait
+
+    # Объединяет накопленные тексты чата в одно сообщение в пределах лимита длины;
+    # возвращает (текст, число объединенных текстов)
+    def _take_text(self, chat_id):
+        texts = self.pending[chat_id]
+        count, length = 1, len(texts[0])
+        while count < len(texts) and length + 2 + len(texts[count]) <= MESSAGE_LIMIT:
+            length += 2 + len(texts[count])
+            count += 1
+        text = "\n\n".join(texts[:count])
+        del texts[:count]
+        if not texts:
+            del self.pending[chat_id]
+            del self.queued_at[chat_id]
+        return text, count
+
+    def _deliver(self, chat_id, text, count):
+        retry_after = None
+        try:
+            retry_after = self.send(chat_id, text)
+        except Exception as e:
+            print(f"Ошибка при отправке уведомления чату {chat_id}: {e}")
+        else:
+            if not retry_after:
+                metrics.messages_sent.inc()
+                metrics.alerts_sent.inc(count)
+        with self.condition:
+            self.in_flight.discard(chat_id)
+            if retry_after:
+                # Telegram попросил подождать: возвращаем сообщение в начало очереди чата
+                if chat_id not in self.pending:
+                    self.pending[chat_id] = []
+                    self.queued_at[chat_id] = time.monotonic()
+                self.pending[chat_id].insert(0, text)
+                self.next_allowed[chat_id] = time.monotonic() + retry_after
+            self.condition.notify()
@@ -0,0 +1,86 @@
+# Запись рыночных данных (цен тикера и закрытых свечей) в компактный двоичный файл
+# для последующего воспроизведения в replay.py. Каждая запись занимает 19 байт,
+# имена символов хранятся рядом в текстовом файле <path>.symbols
+import os
+import threading
+
+import numpy as np
+
+# Вид записи: цена тикера или цена закрытия минутной свечи
+TICKER = 0
+KLINE = 1
+
+# time - время получения цены или время закрытия свечи (в миллисекундах), symbol - номер строки в .symbols
+RECORD_DTYPE = np.dtype([("time", "<i8"), ("symbol", "<u2"), ("kind", "u1"), ("price", "<f8")])
+
+
+def symbols_path(path):
+    return f"{path}.symbols"
+
+
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Запись дописывается в конец существующего файла, номера символов сохраняются
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(read_symbols(path))}
+        self.file = open(path, "ab")
+        self.symbols_file = open(symbols_path(path), "a")
+
+    def _symbol_id(self, symbol):
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = self.symbol_ids[symbol] = len(self.symbol_ids)
+            self.symbols_file.write(symbol + "\n")
+            self.symbols_file.flush()
+        return symbol_id
+
+    # Записывает цены тикера {symbol: price}, полученные в момент timestamp (в секундах)
+    def record_prices(self, timestamp, prices):
+        if not prices:
+            return
+        with self.lock:
+            records = np.empty(len(prices), dtype=RECORD_DTYPE)
+            records["time"] = int(timestamp * 1000)
+            records["symbol"] = [self._symbol_id(symbol) for symbol in prices]
+            records["kind"] = TICKER
+            records["price"] = list(prices.values())
+            self.file.write(records.tobytes())
+
+    # Записывает закрытые свечи символа вида {"price": ..., "time": ...}
+    def record_candles(self, symbol, data):
+        if not data:
+            return
+        with self.lock:
+            records = np.empty(len(data), dtype=RECORD_DTYPE)
+            records["time"] = [item["time"] for item in data]
+            records["symbol"] = self._symbol_id(symbol)
+            records["kind"] = KLINE
+            records["price"] = [item["price"] for item in data]
+            self.file.write(records.tobytes())
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            self.symbols_file.close()
+
+
+def read_symbols(path):
+    if not os.path.exists(symbols_path(path)):
+        return []
+    with open(symbols_path(path)) as symbols_file:
+        return [line.strip() for line in symbols_file if line.strip()]
+
+
+# Отображает файл записи в память без чтения; возвращает (список символов, массив записей)
+def load_recording(path):
+    symbols = read_symbols(path)
+    # Недописанная последняя запись (например, после аварийной остановки) отбрасывается
+    count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    if not count:
+        return symbols, np.empty(0, dtype=RECORD_DTYPE)
+    return symbols, np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(count,))
@@ -0,0 +1,205 @@
+# Воспроизведение записанных рыночных данных (recorder.py) без сети и Telegram: показывает,
+# какие уведомления отправил бы бот при заданных настройках чата.
+# Запись:       python replay.py record market.bin --symbols BTCUSDT ETHUSDT --duration 3600
+# Проверка:     python replay.py backtest market.bin --threshold 0.5 1 2 --timeout 60 300 --levels 30000
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from itertools import product
+
+import numpy as np
+
+from alerts import should_alert
+from config import MA_PERIOD, FEED_INTERVAL
+from recorder import TICKER, KLINE, Recorder, load_recording
+
+# Котируемые активы, по которым символ из записи делится на пару для текста уведомлений
+QUOTE_ASSETS = ("USDT", "FDUSD", "USDC", "BUSD", "TUSD", "BTC", "ETH", "BNB", "EUR", "TRY")
+
+
+# Данные одного символа из записи: времена и цены тикера (по возрастанию времени)
+# и закрытые свечи без повторов
+class SymbolSeries:
+    def __init__(self, tick_times, tick_prices, kline_times, kline_prices):
+        order = np.argsort(tick_times, kind="stable")
+        self.tick_times = tick_times[order]
+        self.tick_prices = tick_prices[order]
+        # Закрытые свечи не меняются, поэтому повторно загруженные свечи просто отбрасываются
+        self.kline_times, first = np.unique(kline_times, return_index=True)
+        self.kline_prices = kline_prices[first]
+
+    # Скользящее среднее по period последним свечам, закрытым к моменту каждой цены тикера (nan - свечей мало)
+    def moving_averages(self, period):
+        sums = np.concatenate(([0.0], np.cumsum(self.kline_prices)))
+        # Номер последней свечи, закрытой раньше времени цены
+        last = np.searchsorted(self.kline_times, self.tick_times, side="left") - 1
+        enough = last >= period - 1
+        result = np.full(len(self.tick_times), np.nan)
+        result[enough] = (sums[last[enough] + 1] - sums[last[enough] + 1 - period]) / period
+        return result
+
+
+# Разбивает запись на ряды по символам; symbols - фильтр по именам (None - все символы)
+def split_series(path, symbols=None):
+    names, records = load_recording(path)
+    wanted = None if symbols is None else {names.index(symbol) for symbol in symbols if symbol in names}
+    order = np.argsort(records["symbol"], kind="stable")
+    ids = records["symbol"][order]
+    bounds = np.flatnonzero(np.diff(ids)) + 1
+    result = {}
+    for chunk in np.split(order, bounds):
+        if not len(chunk):
+            continue
+        symbol_id = int(records["symbol"][chunk[0]])
+        if wanted is not None and symbol_id not in wanted:
+            continue
+        part = records[chunk]
+        ticks = part[part["kind"] == TICKER]
+        klines = part[part["kind"] == KLINE]
+        result[names[symbol_id]] = SymbolSeries(ticks["time"], ticks["price"], klines["time"], klines["price"])
+    return result
+
+
+# Воспроизводит проверки одного чата с настройками interval, threshold, timeout и уровнями levels
+# по ряду символа; ma - скользящие средние ряда. Возвращает (индексы цен ряда с уведомлением об изменении,
+# изменения в процентах для этих уведомлений, [(индекс цены ряда, уровень)] для достигнутых уровней)
+def replay_chat(series, ma, interval, threshold, timeout, levels):
+    seconds = series.tick_times // 1000
+    # Чат проверяется один раз за свой интервал: берем первую цену каждого интервала
+    buckets = seconds // max(1, round(interval / FEED_INTERVAL) * FEED_INTERVAL)
+    checked = np.flatnonzero(np.concatenate(([True], np.diff(buckets) != 0)))
+    prices = series.tick_prices[checked]
+    now = seconds[checked]
+
+    # Условие уведомления то же, что и в AlertIndex; таймаут отсчитывается от предыдущего уведомления
+    with np.errstate(invalid="ignore"):
+        change = (prices - ma[checked]) / ma[checked] * 100
+        candidates = np.flatnonzero(should_alert(change, threshold, now, -np.inf, timeout))
+    # Для каждого кандидата заранее находим первого кандидата, до которого истечет таймаут,
+    # и проходим по этим переходам от первого уведомления
+    candidate_times = now[candidates]
+    following = np.maximum(np.searchsorted(candidate_times, candidate_times + timeout, side="left"),
+                           np.arange(1, len(candidates) + 1)).tolist()
+    alerts = []
+    position = 0
+    while position < len(candidates):
+        alerts.append(position)
+        position = following[position]
+    alerts = candidates[np.array(alerts, dtype=np.intp)]
+
+    # Уровень достигнут, когда он оказался между предыдущей и текущей проверенной ценой
+    level_hits = []
+    if len(prices):
+        previous = np.concatenate((prices[:1], prices[:-1]))
+        low, high = np.minimum(previous, prices), np.maximum(previous, prices)
+        for level in levels:
+            hits = np.flatnonzero((low <= level) & (level <= high))
+            if len(hits):
+                level_hits.append((checked[hits[0]], level))
+    return checked[alerts], change[alerts], sorted(level_hits)
+
+
+def split_symbol(symbol):
+    for quote_asset in QUOTE_ASSETS:
+        if symbol.endswith(quote_asset) and len(symbol) > len(quote_asset):
+            return symbol[:-len(quote_asset)], quote_asset
+    return symbol, ""
+
+
+def format_time(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat()
+
+
+# Прогоняет все сочетания настроек по всем символам записи; details - добавить список уведомлений
+def backtest(path, thresholds, timeouts, intervals, levels=(), symbols=None, period=MA_PERIOD, details=False):
+    # Тексты уведомлений формируются теми же функциями, что и в боте
+    from main import alert, notification
+
+    started = time.perf_counter()
+    series_by_symbol = split_series(path, symbols)
+    results = {}
+    ticks = 0
+    for symbol, series in series_by_symbol.items():
+        ticks += len(series.tick_times)
+        ma = series.moving_averages(period)
+        base_asset, quote_asset = split_symbol(symbol)
+        rows = []
+        for interval, threshold, timeout in product(intervals, thresholds, timeouts):
+            alerted, changes, level_hits = replay_chat(series, ma, interval, threshold, timeout, levels)
+            row = {
+                "interval": interval,
+                "change_threshold": threshold,
+                "alert_timeout": timeout,
+                "change_alerts": len(alerted),
+                "level_alerts": len(level_hits),
+            }
+            if details:
+                events = [{
+                    "time": format_time(series.tick_times[i]),
+                    "price": float(series.tick_prices[i]),
+                    "text": alert(float(change), base_asset, quote_asset, float(series.tick_prices[i])),
+                } for i, change in zip(alerted, changes)]
+                events += [{
+                    "time": format_time(series.tick_times[i]),
+                    "price": float(series.tick_prices[i]),
+                    "text": notification(base_asset, quote_asset, float(series.tick_prices[i]), level),
+                } for i, level in level_hits]
+                row["events"] = sorted(events, key=lambda event: event["time"])
+            rows.append(row)
+        results[symbol] = rows
+    return {"ticks": ticks, "symbols": len(results), "seconds": time.perf_counter() - started, "results": results}
+
+
+# Записывает цены тикера каждые FEED_INTERVAL секунд и новые закрытые свечи символов в файл path
+def record(path, symbols, duration):
+    import main
+
+    main.recorder = Recorder(path)
+    deadline = time.time() + duration if duration else None
+    try:
+        while deadline is None or time.time() < deadline:
+            started = time.time()
+            main.get_asset_prices(symbols)
+            for symbol in symbols:
+                try:
+                    main.get_moving_average(symbol)
+                except Exception as e:
+                    print(f"Ошибка в получении свечей {symbol}: {e}")
+            main.recorder.flush()
+            time.sleep(max(0.0, FEED_INTERVAL - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        main.recorder.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Запись рыночных данных и проверка настроек уведомлений на них")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="записывать цены и свечи с Binance")
+    record_parser.add_argument("path", help="файл записи (дописывается, если существует)")
+    record_parser.add_argument("--symbols", nargs="+", required=True, help="символы, например BTCUSDT ETHUSDT")
+    record_parser.add_argument("--duration", type=float, default=None, help="длительность записи в секундах")
+
+    backtest_parser = commands.add_parser("backtest", help="воспроизвести запись с разными настройками")
+    backtest_parser.add_argument("path", help="файл записи")
+    backtest_parser.add_argument("--symbols", nargs="+", default=None, help="символы (по умолчанию все)")
+    backtest_parser.add_argument("--threshold", type=float, nargs="+", default=[1], help="пороги изменения в процентах")
+    backtest_parser.add_argument("--timeout", type=int, nargs="+", default=[300], help="таймауты уведомлений в секундах")
+    backtest_parser.add_argument("--interval", type=int, nargs="+", default=[3], help="интервалы проверки в секундах")
+    backtest_parser.add_argument("--levels", type=float, nargs="*", default=[], help="ценовые уровни")
+    backtest_parser.add_argument("--period", type=int, default=MA_PERIOD, help="период скользящего среднего в минутах")
+    backtest_parser.add_argument("--details", action="store_true", help="вывести время и текст каждого уведомления")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.command == "record":
+        record(arguments.path, arguments.symbols, arguments.duration)
+    else:
+        report = backtest(arguments.path, arguments.threshold, arguments.timeout, arguments.interval,
+                          arguments.levels, arguments.symbols, arguments.period, arguments.details)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
@@ -0,0 +1,125 @@
+# Скользящее среднее по закрытым свечам на кольцевом буфере с накопленной суммой
+import math
+import threading
+
+from klines import KlineCache
+
+
+class RollingMean:
+    def __init__(self, period):
+        self.period = period
+        # Кольцевой буфер цен закрытия и позиция самой старой цены в нем
+        self.values = [0.0] * period
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        # Время закрытия последней учтенной свечи (в миллисекундах)
+        self.last_time = None
+
+    # Заполняет буфер по списку закрытых свечей вида {"price": ..., "time": ...}
+    def seed(self, data):
+        closes = data[-self.period:]
+        self.values = [0.0] * self.period
+        self.index = 0
+        self.count = 0
+        for item in closes:
+            self.values[self.count] = item["price"]
+            self.count += 1
+        self.index = self.count % self.period
+        self.total = math.fsum(self.values[:self.count])
+        self.last_time = closes[-1]["time"] if closes else None
+
+    # Добавляет новую закрытую свечу, вытесняя самую старую
+    def push(self, price, close_time):
+        if self.count < self.period:
+            self.values[self.count] = price
+            self.count += 1
+            self.total += price
+        else:
+            self.total += price - self.values[self.index]
+            self.values[self.index] = price
+        self.index = (self.index + 1) % self.period
+        # Раз за полный оборот буфера пересчитываем сумму точно, чтобы ошибка округления не накапливалась
+        if self.index == 0:
+            self.total = math.fsum(self.values[:self.count])
+        self.last_time = close_time
+
+    # Текущее значение среднего или None, пока в буфере меньше period свечей
+    @property
+    def value(self):
+        if self.count < self.period:
+            return None
+        return self.total / self.period
+
+
+# Скользящие средние по символам поверх кэша закрытых свечей: история загружается
+# целиком только при первом обращении, далее запрашиваются лишь новые свечи
+class MovingAverages:
+    def __init__(self, period):
+        self.period = period
+        self.klines = KlineCache(period)
+        # symbol -> RollingMean
+        self.averages = {}
+        # Блокировка нужна, так как свечи добавляют поток мониторинга, поток WebSocket, поток
+        # догрузки после переподключения, а символы удаляют обработчики команд
+        self.lock = threading.Lock()
+
+    def value(self, symbol):
+        with self.lock:
+            rolling = self.averages.get(symbol)
+            return rolling.value if rolling is not None else None
+
+    # Время закрытия последней учтенной в среднем свечи символа или None
+    def last_time(self, symbol):
+        with self.lock:
+            rolling = self.averages.get(symbol)
+            return rolling.last_time if rolling is not None else None
+
+    # Параметры запроса свечей для обновления среднего символа: (startTime, limit) или None
+    def candles_to_fetch(self, symbol, now_ms):
+        with self.lock:
+            return self.klines.request(symbol, now_ms)
+
+    # Применяет свечи, загруженные по candles_to_fetch, и возвращает среднее
+    def apply(self, symbol, data, now_ms):
+        with self.lock:
+            return self._apply(symbol, data, now_ms)
+
+    def _apply(self, symbol, data, now_ms):
+        added, gap = self.klines.add(symbol, data, now_ms)
+        rolling = self.averages.get(symbol)
+        if rolling is None or gap:
+            # Нет буфера или в истории разрыв: заполняем буфер из окна кэша
+            rolling = RollingMean(self.period)
+            rolling.seed(list(self.klines.get(symbol)))
+            self.averages[symbol] = rolling
+        else:
+            for item in added:
+                rolling.push(item["price"], item["time"])
+        return rolling.value
+
+    # Добавляет закрытую свечу из потока; возвращает False, если перед ней есть пропуск
+    def push(self, symbol, price, close_time):
+        with self.lock:
+            rolling = self.averages.get(symbol)
+            if rolling is None or not self.klines.append(symbol, price, close_time):
+                return False
+            rolling.push(price, close_time)
+            return True
+
+    def discard(self, symbol):
+        with self.lock:
+            self.averages.pop(symbol, None)
+            self.klines.discard(symbol)
+
+    # Оставляет только средние и свечи указанных символов
+    def retain(self, symbols):
+        with self.lock:
+            for symbol in list(self.averages):
+                if symbol not in symbols:
+                    del self.averages[symbol]
+            self.klines.retain(symbols)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.averages)
@@ -0,0 +1,82 @@
+# Общие HTTP-сессии с пулом keep-alive соединений: по одной на каждый внешний сервис
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from config import BINANCE_API_URL, TELEGRAM_API_URL, TELEGRAM_TOKEN, BINANCE_POOL_SIZE, TELEGRAM_POOL_SIZE, \
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES, HTTP_BACKOFF, BINANCE_WEIGHT_LIMIT, \
+    BINANCE_WEIGHT_RESERVE, BINANCE_WEIGHT_SCARCE
+from weights import WeightBudget, request_weight
+
+
+# Политика повторов, считающая каждый повтор в метрике upstream_retries
+class CountedRetry(Retry):
+    upstream = ""
+
+    def increment(self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)
+        metrics.upstream_retries.inc(upstream=self.upstream)
+        return retry
+
+
+# Создает сессию с пулом соединений и ограниченным числом повторов с растущей задержкой.
+# retry_reads=False запрещает повтор после отправленного запроса (чтобы не дублировать сообщения),
+# respect_retry_after=False запрещает повтор ответов 429 с заголовком Retry-After
+def create_session(upstream, pool_size, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, retry_reads=True,
+                   respect_retry_after=True):
+    # Urllib3 пересоздает объект повторов через type(self), поэтому имя сервиса хранится в подклассе
+    retry_class = type(f"{upstream.capitalize()}Retry", (CountedRetry,), {"upstream": upstream})
+    retry = retry_class(
+        total=retries,
+        connect=retries,
+        read=retries if retry_reads else 0,
+        status=retries if retry_reads else 0,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=respect_retry_after,
+        # Ответ с ошибкой после исчерпания повторов возвращается вызывающему коду
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Ответы Binance 429 и 418 не повторяются внутри запроса: их обрабатывает binance_weights,
+# приостанавливая все запросы на время из Retry-After
+binance_session = create_session("binance", BINANCE_POOL_SIZE, respect_retry_after=False)
+telegram_session = create_session("telegram", TELEGRAM_POOL_SIZE, retry_reads=False)
+
+# Расход веса запросов к Binance, общий для всех потоков процесса
+binance_weights = WeightBudget(BINANCE_WEIGHT_LIMIT, BINANCE_WEIGHT_RESERVE, BINANCE_WEIGHT_SCARCE)
+
+
+# Выполняет запрос, считая сетевые ошибки и ответы с кодом ошибки в метрике upstream_errors
+def counted_request(upstream, request, *args, **kwargs):
+    try:
+        response = request(*args, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), **kwargs)
+    except requests.exceptions.RequestException:
+        metrics.upstream_errors.inc(upstream=upstream)
+        raise
+    if response.status_code >= 400:
+        metrics.upstream_errors.inc(upstream=upstream)
+    return response
+
+
+# GET-запрос к REST API Binance, path вида "/api/v3/klines". Пока Binance запретил запросы
+# после 429 или 418, запрос не отправляется и вызывается RateLimited
+def binance_get(path, params=None):
+    binance_weights.spend(request_weight(path, params))
+    response = counted_request("binance", binance_session.get, f"{BINANCE_API_URL}{path}", params=params)
+    binance_weights.observe(response.status_code, response.headers)
+    return response
+
+
+# POST-запрос к Bot API Telegram, method вида "sendMessage"
+def telegram_post(method, data):
+    return counted_request("telegram", telegram_session.post, f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/{method}",
+                           data=data)
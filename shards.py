@@ -0,0 +1,209 @@
+# Многопроцессный режим мониторинга: символы распределяются по процессам-шардам
+# согласованным хешированием, каждый шард сам получает цены и проверяет свои чаты,
+# а уведомления возвращает процессу бота, который их отправляет
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+
+import config
+
+
+# Номер шарда символа по алгоритму rendezvous hashing: при изменении числа шардов
+# переезжают только символы, доставшиеся добавленному или удаленному шарду
+def shard_of(symbol, workers):
+    return max(range(workers), key=lambda shard: zlib.crc32(f"{shard}:{symbol}".encode()))
+
+
+class ShardPool:
+    # on_alerts([(chat_id, text)]) ставит уведомления в очередь отправки,
+    # on_state(monitor, alert_timestamp, price_levels) сохраняет изменившееся в шарде состояние чата,
+    # on_prices({symbol: price}) обновляет снимок цен процесса бота для обработчиков команд
+    def __init__(self, workers, on_alerts, on_state, interval=None, on_prices=None):
+        self.workers = workers
+        self.on_alerts = on_alerts
+        self.on_state = on_state
+        self.on_prices = on_prices
+        self.interval = interval or config.FEED_INTERVAL
+        # Процессы запускаются заново (spawn), а не копией процесса бота с его потоками
+        self.context = multiprocessing.get_context("spawn")
+        self.commands = [self.context.Queue() for _ in range(workers)]
+        self.results = self.context.Queue()
+        self.processes = []
+        self.lock = threading.Lock()
+        # chat_id -> номер шарда, в котором чат сейчас подписан
+        self.chat_shards = {}
+        # chat_id -> монитор текущей подписки чата. Каждая подписка получает новое поколение
+        # (monitor["generation"]), и состояние, посчитанное шардом по прежней подписке, отбрасывается
+        self.chat_monitors = {}
+        self.generations = itertools.count(1)
+        # symbol -> номер шарда
+        self.symbol_shards = {}
+        # Сводка работы шардов: тики, проверенные чаты и время, затраченное на тики (в секундах)
+        self.ticks = 0
+        self.checks = 0
+        self.busy = 0.0
+        self.thread = None
+
+    def _track(self, monitor):
+        monitor["generation"] = next(self.generations)
+        self.chat_monitors[monitor["chat_id"]] = monitor
+
+    def _shard(self, symbol):
+        shard = self.symbol_shards.get(symbol)
+        if shard is None:
+            shard = self.symbol_shards[symbol] = shard_of(symbol, self.workers)
+        return shard
+
+    # Запускает процессы шардов и передает им уже подписанные чаты одним пакетом на шард
+    def start(self, monitors=()):
+        # Шарды работают с теми же настройками, что и процесс бота (включая измененные во время работы)
+        settings = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+        batches = [[] for _ in range(self.workers)]
+        with self.lock:
+            for monitor in monitors:
+                shard = self._shard(f"{monitor['base_asset']}{monitor['quote_asset']}")
+                self.chat_shards[monitor["chat_id"]] = shard
+                self._track(monitor)
+                batches[shard].append(monitor)
+        for shard in range(self.workers):
+            process = self.context.Process(target=run_worker, name=f"shard-{shard}", daemon=True,
+                                           args=(self.commands[shard], self.results, settings, self.interval))
+            process.start()
+            self.processes.append(process)
+            self.commands[shard].put(("subscribe", batches[shard]))
+        self.thread = threading.Thread(target=self._collect, name="shard-results", daemon=True)
+        self.thread.start()
+
+    def subscribe(self, monitor):
+        shard = self._shard(f"{monitor['base_asset']}{monitor['quote_asset']}")
+        with self.lock:
+            previous = self.chat_shards.get(monitor["chat_id"])
+            self.chat_shards[monitor["chat_id"]] = shard
+            self._track(monitor)
+            # Чат сменил символ другого шарда: убираем его из прежнего шарда
+            if previous is not None and previous != shard:
+                self.commands[previous].put(("unsubscribe", [monitor["chat_id"]]))
+            self.commands[shard].put(("subscribe", [monitor]))
+
+    def unsubscribe(self, chat_id):
+        with self.lock:
+            shard = self.chat_shards.pop(chat_id, None)
+            self.chat_monitors.pop(chat_id, None)
+            if shard is not None:
+                self.commands[shard].put(("unsubscribe", [chat_id]))
+
+    def stop(self):
+        for commands in self.commands:
+            commands.put(("stop", None))
+        for process in self.processes:
+            process.join(timeout=5)
+        self.results.put(None)
+
+    # Принимает от шардов уведомления и изменения состояния чатов
+    def _collect(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            alerts, states, checks, busy, prices = result
+            self.ticks += 1
+            self.checks += checks
+            self.busy += busy
+            if prices and self.on_prices is not None:
+                self.on_prices(prices)
+            if alerts:
+                self.on_alerts(alerts)
+            # Состояние применяется под блокировкой, чтобы новая подписка чата не вклинилась
+            # между проверкой поколения и записью
+            with self.lock:
+                for chat_id, generation, alert_timestamp, price_levels in states:
+                    monitor = self.chat_monitors.get(chat_id)
+                    if monitor is not None and monitor["generation"] == generation:
+                        self.on_state(monitor, alert_timestamp, price_levels)
+
+
+# Подменяет в процессе шарда очередь отправки и хранилище: уведомления и измененные
+# мониторы копятся за тик и отправляются процессу бота одним сообщением
+class ResultRelay:
+    def __init__(self):
+        # В потоковом режиме уведомления добавляются из потока WebSocket
+        self.lock = threading.Lock()
+        self.alerts = []
+        self.states = {}
+
+    # Интерфейс Outbox
+    def put(self, chat_id, text):
+        with self.lock:
+            self.alerts.append((chat_id, text))
+
+    # Интерфейс MonitorStore; остановленные чаты сохраняет процесс бота
+    def save(self, monitor, active=True):
+        if active:
+            with self.lock:
+                self.states[monitor["chat_id"]] = monitor
+
+    # prices - последние цены символов шарда
+    def flush(self, results, checks, busy, prices):
+        with self.lock:
+            alerts, self.alerts = self.alerts, []
+            states, self.states = self.states, {}
+        if not alerts and not states and not checks and not prices:
+            return
+        states = [(chat_id, monitor["generation"], monitor["alert_timestamp"], list(monitor["price_levels"]))
+                  for chat_id, monitor in states.items()]
+        results.put((alerts, states, checks, busy, prices))
+
+
+# Точка входа процесса шарда
+def run_worker(commands, results, settings, interval):
+    for name, value in settings.items():
+        setattr(config, name, value)
+    # main импортируется после применения настроек, так как модули читают config при импорте
+    import main
+
+    relay = ResultRelay()
+    main.outbox = relay
+    main.store = relay
+    if config.MARKET_DATA_MODE == "stream":
+        main.start_stream()
+
+    # Цены, уже переданные процессу бота, с временем получения: повторно передаются только
+    # полученные заново, чтобы снимок процесса бота не считал их устаревшими
+    sent_prices = {}
+    next_tick = time.monotonic()
+    while True:
+        # До наступления тика применяем изменения подписок
+        while True:
+            timeout = next_tick - time.monotonic()
+            try:
+                command, payload = commands.get(timeout=timeout) if timeout > 0 else commands.get_nowait()
+            except queue.Empty:
+                break
+            if command == "stop":
+                return
+            if command == "subscribe":
+                for monitor in payload:
+                    main.subscribe_monitor(monitor, persist=False)
+            elif command == "unsubscribe":
+                for chat_id in payload:
+                    main.unsubscribe_monitor(chat_id)
+
+        # Затянувшийся тик не копит очередь: следующий отсчитывается от текущего момента
+        next_tick = max(next_tick + interval, time.monotonic())
+        started = time.perf_counter()
+        checks = 0
+        if not main.is_streaming():
+            try:
+                checks = main.poll_prices(time.time())
+            except Exception as e:
+                print(f"Ошибка мониторинга в шарде: {e}")
+        prices = {}
+        for symbol in main.feed.symbols():
+            entry = main.price_snapshot.entry(symbol)
+            if entry is not None and sent_prices.get(symbol) != entry:
+                sent_prices[symbol] = entry
+                prices[symbol] = entry[0]
+        relay.flush(results, checks, time.perf_counter() - started, prices)
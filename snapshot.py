@@ -0,0 +1,36 @@
+# Общий снимок последних цен по символам. Вместе с ценой хранится время ее получения:
+# обработчики команд и индекс ценовых уровней используют только свежие цены
+import time
+
+from config import SNAPSHOT_MAX_AGE
+
+
+class PriceSnapshot:
+    def __init__(self, max_age=SNAPSHOT_MAX_AGE):
+        # Цена старше max_age секунд считается устаревшей
+        self.max_age = max_age
+        # symbol -> (price, время получения)
+        self.entries = {}
+
+    # Заносит цены {symbol: price}, полученные в момент now
+    def update(self, prices, now=None):
+        now = time.time() if now is None else now
+        for symbol, price in prices.items():
+            self.entries[symbol] = (price, now)
+
+    def set(self, symbol, price, now=None):
+        self.entries[symbol] = (price, time.time() if now is None else now)
+
+    # Последняя цена символа и время ее получения (None - цена не получалась)
+    def entry(self, symbol):
+        return self.entries.get(symbol)
+
+    # Последняя цена символа, если она не устарела, иначе None
+    def get(self, symbol, now=None):
+        entry = self.entries.get(symbol)
+        if entry is None:
+            return None
+        price, received = entry
+        if (time.time() if now is None else now) - received > self.max_age:
+            return None
+        return price
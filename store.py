@@ -0,0 +1,134 @@
+# Хранилище настроек и состояния мониторов чатов в SQLite. Изменения копятся в памяти
+# и записываются пачками в фоновом потоке, чтобы проверка цен не ждала диска
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monitors (
+    chat_id INTEGER PRIMARY KEY,
+    base_asset TEXT NOT NULL,
+    quote_asset TEXT NOT NULL,
+    interval INTEGER NOT NULL,
+    alert_timeout INTEGER NOT NULL,
+    change_threshold REAL NOT NULL,
+    price_levels TEXT NOT NULL,
+    previous_price REAL,
+    alert_timestamp INTEGER,
+    active INTEGER NOT NULL
+)
+"""
+
+UPSERT = """
+INSERT INTO monitors (chat_id, base_asset, quote_asset, interval, alert_timeout, change_threshold,
+                      price_levels, previous_price, alert_timestamp, active)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(chat_id) DO UPDATE SET
+    base_asset = excluded.base_asset,
+    quote_asset = excluded.quote_asset,
+    interval = excluded.interval,
+    alert_timeout = excluded.alert_timeout,
+    change_threshold = excluded.change_threshold,
+    price_levels = excluded.price_levels,
+    previous_price = excluded.previous_price,
+    alert_timestamp = excluded.alert_timestamp,
+    active = excluded.active
+"""
+
+COLUMNS = ("chat_id", "base_asset", "quote_asset", "interval", "alert_timeout", "change_threshold",
+           "price_levels", "previous_price", "alert_timestamp", "active")
+
+
+class MonitorStore:
+    # path - файл базы SQLite, flush_interval - период записи накопленных изменений (в секундах)
+    def __init__(self, path, flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # WAL не блокирует чтение на время записи и быстрее при частых небольших транзакциях
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+        self.condition = threading.Condition()
+        # chat_id -> (монитор, активен ли мониторинг чата) для записи
+        self.dirty = {}
+        self.thread = None
+        self.running = False
+
+    # Возвращает все сохраненные чаты в виде словарей с полями COLUMNS
+    def load(self):
+        rows = self.connection.execute(f"SELECT {', '.join(COLUMNS)} FROM monitors").fetchall()
+        result = []
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            record["price_levels"] = json.loads(record["price_levels"])
+            record["active"] = bool(record["active"])
+            result.append(record)
+        return result
+
+    # Отмечает монитор для записи; сами значения читаются из него в момент записи.
+    # Остановленный чат (active=False) сохраняет настройки, но не восстанавливается в мониторинг
+    def save(self, monitor, active=True):
+        with self.condition:
+            self.dirty[monitor["chat_id"]] = (monitor, active)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="monitor-store", daemon=True)
+        self.thread.start()
+
+    # Останавливает фоновую запись, записывает оставшиеся изменения и закрывает базу
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+        self.connection.close()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.running:
+                    self.condition.wait(self.flush_interval)
+                if not self.running:
+                    return
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Ошибка сохранения состояния мониторов: {e}")
+
+    # Записывает все накопленные изменения одной транзакцией
+    def flush(self):
+        with self.condition:
+            dirty, self.dirty = self.dirty, {}
+        if not dirty:
+            return
+        rows = [row(monitor, active) for monitor, active in dirty.values()]
+        try:
+            with self.connection:
+                self.connection.executemany(UPSERT, rows)
+        except sqlite3.Error:
+            # Неудачная запись повторится при следующем сбросе; более новые изменения не затираются
+            with self.condition:
+                for chat_id, entry in dirty.items():
+                    self.dirty.setdefault(chat_id, entry)
+            raise
+
+
+# Строка таблицы monitors из состояния монитора
+def row(monitor, active):
+    return (
+        monitor["chat_id"],
+        monitor["base_asset"],
+        monitor["quote_asset"],
+        monitor["interval"],
+        monitor["alert_timeout"],
+        monitor["change_threshold"],
+        json.dumps(list(monitor["price_levels"])),
+        monitor["previous_price"],
+        monitor["alert_timestamp"],
+        int(active),
+    )
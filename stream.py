@@ -0,0 +1,225 @@
+# Потоковое получение рыночных данных через WebSocket Binance:
+# сделки дают последнюю цену, минутные свечи - закрытые цены для скользящего среднего
+import json
+import queue
+import threading
+import time
+
+import websocket  # Клиент WebSocket (пакет websocket-client)
+
+# Потоки Binance, на которые подписывается каждый символ: сделки и минутные свечи
+STREAM_KINDS = ("trade", "kline_1m")
+
+# Binance обслуживает не больше 1024 потоков на соединение; символы сверх этого
+# распределяются по дополнительным соединениям
+MAX_STREAMS = 1024
+
+# Сколько потоков подписывать одним сообщением и минимальная пауза между сообщениями:
+# Binance принимает не больше 5 входящих сообщений в секунду на соединение
+SUBSCRIBE_CHUNK = 100
+SUBSCRIBE_PAUSE = 0.25
+
+# Пределы задержки между попытками переподключения (в секундах)
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+
+# Имена потоков Binance для символов
+def stream_names(symbols):
+    return [f"{symbol.lower()}@{kind}" for symbol in symbols for kind in STREAM_KINDS]
+
+
+class MarketStream:
+    def __init__(self, url, on_price, on_candle, on_reconnect=None):
+        # url - адрес вида wss://stream.binance.com:9443/ws (для тестов подходит локальный ws://)
+        self.url = url
+        # on_price(symbol, price) - новая цена сделки
+        self.on_price = on_price
+        # on_candle(symbol, close_price, close_time) - закрылась минутная свеча
+        self.on_candle = on_candle
+        # on_reconnect(symbols) - соединение восстановлено после разрыва, нужно догрузить пропущенное
+        self.on_reconnect = on_reconnect
+        self.lock = threading.Lock()
+        # Соединения и соединение, через которое подписан каждый символ
+        self.connections = []
+        self.symbol_connections = {}
+        self.running = False
+
+    # Поток цен подключен, если открыты все его соединения
+    @property
+    def connected(self):
+        with self.lock:
+            connections = list(self.connections)
+        return bool(connections) and all(connection.connected for connection in connections)
+
+    def start(self):
+        with self.lock:
+            self.running = True
+            connections = list(self.connections)
+        for connection in connections:
+            connection.start()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            connections = list(self.connections)
+        for connection in connections:
+            connection.stop()
+
+    def subscribe(self, symbol):
+        capacity = MAX_STREAMS // len(STREAM_KINDS)
+        with self.lock:
+            if symbol in self.symbol_connections:
+                return
+            connection = next((connection for connection in self.connections if len(connection.symbols) < capacity),
+                              None)
+            created = connection is None
+            if created:
+                connection = StreamConnection(self, len(self.connections))
+                self.connections.append(connection)
+            self.symbol_connections[symbol] = connection
+            connection.add(symbol)
+            start = created and self.running
+        if start:
+            connection.start()
+
+    def unsubscribe(self, symbol):
+        with self.lock:
+            connection = self.symbol_connections.pop(symbol, None)
+            if connection is not None:
+                connection.remove(symbol)
+
+    def handle_message(self, message):
+        try:
+            event = json.loads(message)
+            event_type = event.get("e")
+            if event_type == "trade":
+                self.on_price(event["s"], float(event["p"]))
+            elif event_type == "kline":
+                candle = event["k"]
+                # Учитываем только закрытые свечи
+                if candle["x"]:
+                    self.on_candle(event["s"], float(candle["c"]), int(candle["T"]))
+        except Exception as e:
+            print(f"Ошибка обработки сообщения потока цен: {e}")
+
+
+# Одно соединение WebSocket со своей частью символов. Запросы подписки ставятся в очередь,
+# и отдельный поток отправляет их, объединяя накопившиеся и соблюдая паузу между сообщениями
+class StreamConnection:
+    def __init__(self, stream, number):
+        self.stream = stream
+        self.name = f"market-stream-{number}"
+        # Изменяется под блокировкой MarketStream
+        self.symbols = set()
+        # Запросы вида (method, [symbol]); None останавливает поток отправки
+        self.requests = queue.Queue()
+        self.app = None
+        self.running = False
+        self.connected = False
+        # Число успешных подключений; все после первого считаются переподключениями
+        self.connections = 0
+        self.request_id = 0
+        self.last_sent = 0.0
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name=self.name, daemon=True).start()
+        threading.Thread(target=self._send_requests, name=f"{self.name}-send", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)
+        if self.app is not None:
+            self.app.close()
+
+    def add(self, symbol):
+        self.symbols.add(symbol)
+        self.requests.put(("SUBSCRIBE", [symbol]))
+
+    def remove(self, symbol):
+        self.symbols.discard(symbol)
+        self.requests.put(("UNSUBSCRIBE", [symbol]))
+
+    # Поток отправки: накопившиеся запросы одного вида идут подряд одним сообщением
+    def _send_requests(self):
+        while True:
+            pending = [self.requests.get()]
+            while True:
+                try:
+                    pending.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            batches = []
+            for request in pending:
+                if request is None:
+                    return
+                method, symbols = request
+                if batches and batches[-1][0] == method:
+                    batches[-1][1].extend(symbols)
+                else:
+                    batches.append((method, list(symbols)))
+            for method, symbols in batches:
+                self._send(method, symbols)
+
+    def _send(self, method, symbols):
+        streams = stream_names(symbols)
+        for i in range(0, len(streams), SUBSCRIBE_CHUNK):
+            # Пока соединения нет, запросы не нужны: при открытии подписка отправляется целиком
+            if not self.connected:
+                return
+            time.sleep(max(0.0, self.last_sent + SUBSCRIBE_PAUSE - time.monotonic()))
+            self.request_id += 1
+            try:
+                self.app.send(json.dumps({"method": method, "params": streams[i:i + SUBSCRIBE_CHUNK],
+                                          "id": self.request_id}))
+            except Exception as e:
+                print(f"Не удалось отправить {method} в поток цен: {e}")
+                return
+            finally:
+                self.last_sent = time.monotonic()
+
+    # Цикл соединения: при разрыве переподключаемся с растущей задержкой
+    def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        while self.running:
+            self.app = websocket.WebSocketApp(
+                self.stream.url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+            )
+            started = time.time()
+            self.app.run_forever(ping_interval=60, ping_timeout=20)
+            self.connected = False
+            if not self.running:
+                break
+            # После долгой стабильной работы начинаем отсчет задержки заново
+            if time.time() - started > 60:
+                delay = RECONNECT_MIN_DELAY
+            print(f"Поток цен отключен, переподключение через {delay} секунд")
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _on_open(self, app):
+        reconnect = self.connections > 0
+        self.connections += 1
+        self.connected = True
+        with self.stream.lock:
+            symbols = list(self.symbols)
+        # Переподписываемся на все символы соединения
+        if symbols:
+            self.requests.put(("SUBSCRIBE", symbols))
+        # Догрузку пропущенных свечей выполняем отдельно, чтобы не задерживать чтение потока
+        if reconnect and self.stream.on_reconnect is not None and symbols:
+            threading.Thread(target=self.stream.on_reconnect, args=(symbols,), daemon=True).start()
+
+    def _on_message(self, app, message):
+        self.stream.handle_message(message)
+
+    def _on_error(self, app, error):
+        print(f"Ошибка потока цен: {error}")
+
+    def _on_close(self, app, status_code, message):
+        self.connected = False
@@ -0,0 +1,65 @@
+# Справочник торгуемых пар Binance по ответу /api/v3/exchangeInfo: проверка пары активов
+# в обработчиках команд без запросов к Binance и подсказки при опечатках
+import difflib
+
+# Сколько подсказок показывать для неизвестной пары
+SUGGESTIONS = 3
+
+# Минимальное сходство (от 0 до 1) актива или символа с введенным, чтобы попасть в подсказки
+SUGGESTION_CUTOFF = 0.6
+
+
+class SymbolIndex:
+    def __init__(self):
+        # (base_asset, quote_asset) -> symbol торгуемых пар; None - справочник еще не загружен
+        self.pairs = None
+        # symbol -> (base_asset, quote_asset)
+        self.symbols = {}
+        self.base_assets = []
+        self.quote_assets = []
+
+    # Заменяет справочник данными ответа exchangeInfo; пары, торги которыми остановлены, пропускаются
+    def load(self, data):
+        pairs = {}
+        for item in data["symbols"]:
+            if item.get("status", "TRADING") == "TRADING":
+                pairs[(item["baseAsset"], item["quoteAsset"])] = item["symbol"]
+        # Обработчики команд читают справочник без блокировок, поэтому он заменяется целиком,
+        # а признак загрузки (pairs) присваивается последним
+        self.symbols = {symbol: pair for pair, symbol in pairs.items()}
+        self.base_assets = sorted({base_asset for base_asset, _ in pairs})
+        self.quote_assets = sorted({quote_asset for _, quote_asset in pairs})
+        self.pairs = pairs
+        return len(pairs)
+
+    @property
+    def loaded(self):
+        return self.pairs is not None
+
+    # Торгуется ли пара; пока справочник не загружен, принимается любая пара
+    def known(self, base_asset, quote_asset):
+        return self.pairs is None or (base_asset, quote_asset) in self.pairs
+
+    # Похожие торгуемые пары для неизвестной пары, начиная с самых похожих
+    def suggest(self, base_asset, quote_asset, limit=SUGGESTIONS):
+        pairs = self.pairs or {}
+        candidates = set()
+        # Активы перепутаны местами
+        if (quote_asset, base_asset) in pairs:
+            candidates.add((quote_asset, base_asset))
+        # Опечатка в одном или обоих активах
+        base_assets = difflib.get_close_matches(base_asset, self.base_assets, limit, SUGGESTION_CUTOFF)
+        quote_assets = difflib.get_close_matches(quote_asset, self.quote_assets, limit, SUGGESTION_CUTOFF)
+        candidates.update((base, quote) for base in base_assets for quote in quote_assets if (base, quote) in pairs)
+        # Граница между активами поставлена не там (например, DOG EUSDT)
+        pair = self.symbols.get(f"{base_asset}{quote_asset}")
+        if pair is not None:
+            candidates.add(pair)
+
+        # Сначала самые похожие; при равном сходстве - пары из тех же букв (переставленных при вводе)
+        def order(pair):
+            typed, candidate = f"{base_asset}/{quote_asset}", f"{pair[0]}/{pair[1]}"
+            ratio = difflib.SequenceMatcher(None, typed, candidate).ratio()
+            return -ratio, sorted(typed) != sorted(candidate), pair
+
+        return sorted(candidates, key=order)[:limit]
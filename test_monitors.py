@@ -0,0 +1,81 @@
+# Подписка чатов в main.py: начальная цена для ценовых уровней и восстановление из хранилища
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from store import MonitorStore
+
+SYMBOL = "LVLUSDT"
+
+
+@pytest.fixture
+def chat():
+    chat_id = -1001
+    yield chat_id
+    main.unsubscribe_monitor(chat_id)
+    main.price_snapshot.entries.pop(SYMBOL, None)
+
+
+def monitor(chat_id, levels, previous_price=None):
+    return main.build_monitor(chat_id, {"base_asset": "LVL", "quote_asset": "USDT", "price_levels": levels},
+                              previous_price)
+
+
+def test_stale_snapshot_is_not_a_level_reference(chat):
+    # Цена 90 получена давно; с тех пор цена выросла до 110 еще до подписки
+    main.price_snapshot.update({SYMBOL: 90.0}, now=time.time() - 2 * main.price_snapshot.max_age)
+    main.subscribe_monitor(monitor(chat, [100.0], previous_price=90.0), persist=False)
+    assert main.snapshot_price("LVL", "USDT") is None
+    # Отсчет начинается с первой полученной цены: уровень, пересеченный до подписки, не срабатывает
+    assert main.price_levels_index.update(SYMBOL, 110.0) == []
+    assert main.price_levels_index.update(SYMBOL, 99.0) == [(100.0, chat)]
+
+
+def test_fresh_snapshot_is_a_level_reference(chat):
+    main.price_snapshot.update({SYMBOL: 90.0})
+    main.subscribe_monitors([monitor(chat, [100.0])], persist=False)
+    assert main.snapshot_price("LVL", "USDT") == 90.0
+    assert main.price_levels_index.update(SYMBOL, 110.0) == [(100.0, chat)]
+
+
+def test_stale_snapshot_price_is_shown_as_pending(chat):
+    main.price_snapshot.update({SYMBOL: 0.00001234})
+    assert main.format_snapshot_price(main.snapshot_price("LVL", "USDT")) == "0.00001234"
+    main.price_snapshot.update({SYMBOL: 0.00001234}, now=time.time() - 2 * main.price_snapshot.max_age)
+    assert main.format_snapshot_price(main.snapshot_price("LVL", "USDT")) == "ожидается"
+
+
+# Хранилище с чатами, сохраненными до перезапуска, и заменитель диспетчера python-telegram-bot
+@pytest.fixture
+def restored(tmp_path, monkeypatch):
+    store = MonitorStore(str(tmp_path / "monitors.sqlite3"), 60)
+    monkeypatch.setattr(main, "store", store)
+    dispatcher = SimpleNamespace(chat_data=defaultdict(dict))
+    yield store, dispatcher
+    for chat_id in list(dispatcher.chat_data):
+        main.unsubscribe_monitor(chat_id)
+    store.close()
+
+
+def test_restore_ignores_stored_prices_as_level_reference(restored):
+    store, dispatcher = restored
+    # Чаты сохранили цены 90 и 120; за время простоя цена ушла к 105
+    for chat_id, previous_price, level in ((-1002, 90.0, 100.0), (-1003, 120.0, 110.0)):
+        store.save(monitor(chat_id, [level], previous_price))
+    store.flush()
+    assert main.restore_monitors(dispatcher) == 2
+    assert main.price_levels_index.update(SYMBOL, 105.0) == []
+    assert main.price_levels_index.update(SYMBOL, 111.0) == [(110.0, -1003)]
+
+
+def test_settings_restored_per_chat(restored):
+    store, dispatcher = restored
+    # Группа: настройки общие для всех участников, поэтому хранятся в данных чата
+    store.save(monitor(-1004, [100.0]), active=False)
+    store.flush()
+    assert main.restore_monitors(dispatcher) == 0
+    assert dispatcher.chat_data[-1004]["base_asset"] == "LVL"
+    assert dispatcher.chat_data[-1004]["price_levels"] == [100.0]
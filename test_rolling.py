@@ -0,0 +1,108 @@
+# Сравнение инкрементального скользящего среднего (rolling.py) с расчетом через pandas (main.moving_average)
+import math
+import random
+import threading
+
+from klines import CANDLE_MS
+from main import moving_average
+from rolling import MovingAverages, RollingMean
+
+PERIOD = 60
+SYMBOL = "ETHUSDT"
+
+
+# Минутные свечи вида {"price": ..., "time": ...}, первая из которых открывается в момент start_open
+def make_candles(start_open, prices):
+    return [{"price": price, "time": start_open + (i + 1) * CANDLE_MS - 1} for i, price in enumerate(prices)]
+
+
+def random_prices(rnd, count, price=30000.0):
+    prices = []
+    for _ in range(count):
+        price *= 1 + rnd.gauss(0, 0.002)
+        prices.append(price)
+    return prices
+
+
+# Среднее по pandas так, как его считал бот: последняя свеча в ответе еще не закрыта
+def expected(closed, open_candle):
+    return moving_average(closed[-PERIOD:] + [open_candle], PERIOD)[-2]
+
+
+def test_seed_matches_pandas():
+    rnd = random.Random(1)
+    data = make_candles(0, random_prices(rnd, PERIOD + 1))
+    now_ms = data[-1]["time"] - CANDLE_MS // 2
+    averages = MovingAverages(PERIOD)
+    assert math.isclose(averages.apply(SYMBOL, data, now_ms), expected(data[:-1], data[-1]), rel_tol=1e-12)
+
+
+def test_single_pushes_match_pandas():
+    rnd = random.Random(2)
+    prices = random_prices(rnd, PERIOD + 1 + 500)
+    candles = make_candles(0, prices)
+    averages = MovingAverages(PERIOD)
+    averages.apply(SYMBOL, candles[:PERIOD + 1], candles[PERIOD]["time"] - 1)
+    for i in range(PERIOD + 1, len(candles)):
+        # Каждый запрос возвращает одну новую закрытую свечу и текущую незакрытую
+        now_ms = candles[i]["time"] - 1
+        value = averages.apply(SYMBOL, candles[i - 1:i + 1], now_ms)
+        assert math.isclose(value, expected(candles[:i], candles[i]), rel_tol=1e-12)
+
+
+def test_stream_pushes_match_pandas():
+    rnd = random.Random(3)
+    candles = make_candles(0, random_prices(rnd, PERIOD + 1 + 200))
+    averages = MovingAverages(PERIOD)
+    averages.apply(SYMBOL, candles[:PERIOD + 1], candles[PERIOD]["time"] - 1)
+    for i in range(PERIOD, len(candles) - 1):
+        assert averages.push(SYMBOL, candles[i]["price"], candles[i]["time"])
+        assert math.isclose(averages.value(SYMBOL), expected(candles[:i + 1], candles[i + 1]), rel_tol=1e-12)
+
+
+def test_gap_keeps_window():
+    rnd = random.Random(4)
+    candles = make_candles(0, random_prices(rnd, 4 * PERIOD))
+    averages = MovingAverages(PERIOD)
+    averages.apply(SYMBOL, candles[:PERIOD + 1], candles[PERIOD]["time"] - 1)
+    received = candles[:PERIOD]
+    # Биржа не отдала 10 свечей (технические работы): среднее считается по последним PERIOD
+    # полученным свечам, включая свечи до пропуска
+    for fresh in (candles[PERIOD + 10:PERIOD + 16], candles[2 * PERIOD:3 * PERIOD + 5]):
+        value = averages.apply(SYMBOL, fresh, fresh[-1]["time"] - 1)
+        received += fresh[:-1]
+        assert math.isclose(value, expected(received, fresh[-1]), rel_tol=1e-12)
+    # Пропуск в потоке не применяется, а сообщается вызывающему для догрузки
+    assert not averages.push(SYMBOL, candles[-1]["price"], candles[-1]["time"])
+
+
+def test_concurrent_stream_and_rest_candles():
+    rnd = random.Random(5)
+    candles = make_candles(0, random_prices(rnd, PERIOD + 1 + 3000))
+    averages = MovingAverages(PERIOD)
+    averages.apply(SYMBOL, candles[:PERIOD + 1], candles[PERIOD]["time"] - 1)
+
+    # Те же свечи одновременно приходят из потока и из REST-запросов; каждая должна учитываться один раз
+    def stream():
+        for candle in candles[PERIOD:-1]:
+            averages.push(SYMBOL, candle["price"], candle["time"])
+
+    def rest():
+        for i in range(PERIOD + 1, len(candles)):
+            averages.apply(SYMBOL, candles[i - 1:i + 1], candles[i]["time"] - 1)
+
+    threads = [threading.Thread(target=stream), threading.Thread(target=rest)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert averages.last_time(SYMBOL) == candles[-2]["time"]
+    assert math.isclose(averages.value(SYMBOL), expected(candles[:-1], candles[-1]), rel_tol=1e-12)
+
+
+def test_value_needs_full_period():
+    rolling = RollingMean(PERIOD)
+    rolling.seed(make_candles(0, [1.0] * (PERIOD - 1)))
+    assert rolling.value is None
+    rolling.push(1.0, PERIOD * CANDLE_MS - 1)
+    assert rolling.value == 1.0
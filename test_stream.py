@@ -0,0 +1,143 @@
+# Потоковый режим (stream.py) на локальных заменителях WebSocket-потоков и REST API Binance
+import math
+import time
+
+import pytest
+
+import main
+import mock_servers
+import sessions
+import stream
+from klines import CANDLE_MS
+from stream import MarketStream
+
+
+# Ждет выполнения условия, которое наступает в потоках клиента и сервера
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("условие не выполнилось за отведенное время")
+
+
+@pytest.fixture
+def stream_server(monkeypatch):
+    monkeypatch.setattr(stream, "RECONNECT_MIN_DELAY", 0.05)
+    server = mock_servers.StreamServer()
+    yield server
+    server.stop()
+
+
+def streams(*symbols):
+    return {f"{symbol.lower()}@{kind}" for symbol in symbols for kind in ("trade", "kline_1m")}
+
+
+def test_dispatch_and_resubscribe_after_drop(stream_server):
+    prices, candles, reconnects = [], [], []
+    client = MarketStream(stream_server.url, lambda symbol, price: prices.append((symbol, price)),
+                          lambda symbol, price, close_time: candles.append((symbol, price, close_time)),
+                          reconnects.append)
+    # Подписка до подключения отправляется при открытии соединения
+    client.subscribe("ETHUSDT")
+    client.start()
+    try:
+        wait_for(lambda: stream_server.subscriptions() == streams("ETHUSDT"))
+        client.subscribe("BTCUSDT")
+        wait_for(lambda: stream_server.subscriptions() == streams("ETHUSDT", "BTCUSDT"))
+
+        stream_server.send_trade("ETHUSDT", 101.5)
+        stream_server.send_kline("ETHUSDT", 102.0, CANDLE_MS - 1, closed=False)
+        stream_server.send_kline("ETHUSDT", 103.0, 2 * CANDLE_MS - 1)
+        wait_for(lambda: prices and candles)
+        assert prices == [("ETHUSDT", 101.5)]
+        # Незакрытая свеча не учитывается
+        assert candles == [("ETHUSDT", 103.0, 2 * CANDLE_MS - 1)]
+
+        # После разрыва клиент переподключается, заново подписывается на все символы
+        # и сообщает, по каким символам догрузить пропущенное
+        stream_server.drop()
+        wait_for(lambda: stream_server.opened == 2 and stream_server.subscriptions() == streams("ETHUSDT", "BTCUSDT"))
+        wait_for(lambda: reconnects)
+        assert sorted(reconnects[0]) == ["BTCUSDT", "ETHUSDT"]
+
+        stream_server.send_trade("BTCUSDT", 30000)
+        wait_for(lambda: len(prices) == 2)
+        assert prices[-1] == ("BTCUSDT", 30000.0)
+    finally:
+        client.stop()
+
+
+def test_reconnect_backfills_missed_candles(stream_server, monkeypatch):
+    rest = mock_servers.serve(path=mock_servers.PricePath(kind="flat", base_price=100.0))
+    monkeypatch.setattr(sessions, "BINANCE_API_URL", f"http://127.0.0.1:{rest.server_address[1]}")
+    symbol = "BACKUSDT"
+    # Свечи по 90 закончились за 5 минут до текущей: за время разрыва закрылись свечи по 100
+    current_open = int(time.time() * 1000) // CANDLE_MS * CANDLE_MS
+    seeded = current_open - 5 * CANDLE_MS
+    history = [{"price": 90.0, "time": seeded - i * CANDLE_MS - 1} for i in reversed(range(main.MA_PERIOD))]
+    main.moving_averages.apply(symbol, history, seeded)
+
+    client = MarketStream(stream_server.url, lambda symbol, price: None, main.on_stream_candle,
+                          main.on_stream_reconnect)
+    client.subscribe(symbol)
+    client.start()
+    try:
+        wait_for(lambda: stream_server.subscriptions() == streams(symbol))
+        stream_server.drop()
+        wait_for(lambda: main.moving_averages.klines.last_time(symbol) >= current_open - 1)
+        missed = (main.moving_averages.klines.last_time(symbol) + 1 - seeded) // CANDLE_MS
+        expected = (90.0 * (main.MA_PERIOD - missed) + 100.0 * missed) / main.MA_PERIOD
+        assert math.isclose(main.moving_averages.value(symbol), expected)
+    finally:
+        client.stop()
+        rest.shutdown()
+        main.moving_averages.discard(symbol)
+
+
+def test_symbols_sharded_and_subscriptions_paced(monkeypatch):
+    # Два символа (4 потока) на соединение вместо 512, чтобы проверить распределение на малом числе символов
+    monkeypatch.setattr(stream, "MAX_STREAMS", 4)
+    monkeypatch.setattr(stream, "SUBSCRIBE_CHUNK", 2)
+    server = mock_servers.StreamServer(max_streams=4)
+    client = MarketStream(server.url, lambda symbol, price: None, lambda symbol, price, close_time: None)
+    symbols = [f"S{i}USDT" for i in range(6)]
+    client.start()
+    try:
+        # Подписки идут пачкой: каждое соединение получает по одному сообщению на символ,
+        # и без паузы между ними превысило бы лимит 5 сообщений в секунду
+        for symbol in symbols:
+            client.subscribe(symbol)
+        wait_for(lambda: server.subscriptions() == streams(*symbols))
+        assert server.opened == 3
+        assert all(len(connection.streams) <= 4 for connection in server.connections)
+        for symbol in symbols[:4]:
+            client.unsubscribe(symbol)
+        # Освободившиеся места занимают новые символы, а не новые соединения
+        client.subscribe("NEWUSDT")
+        wait_for(lambda: server.subscriptions() == streams("S4USDT", "S5USDT", "NEWUSDT"))
+        assert server.opened == 3
+        assert server.rejected == 0
+        assert client.connected
+    finally:
+        client.stop()
+        server.stop()
+
+
+def test_subscriptions_paced(stream_server, monkeypatch):
+    # По одному символу на сообщение: 8 подписок подряд без паузы превысили бы лимит 5 сообщений в секунду
+    monkeypatch.setattr(stream, "SUBSCRIBE_CHUNK", 2)
+    symbols = [f"P{i}USDT" for i in range(9)]
+    client = MarketStream(stream_server.url, lambda symbol, price: None, lambda symbol, price, close_time: None)
+    client.subscribe(symbols[0])
+    client.start()
+    try:
+        wait_for(lambda: stream_server.subscriptions() == streams(symbols[0]))
+        for symbol in symbols[1:]:
+            client.subscribe(symbol)
+        wait_for(lambda: stream_server.subscriptions() == streams(*symbols))
+        assert stream_server.opened == 1
+        assert stream_server.rejected == 0
+    finally:
+        client.stop()
@@ -0,0 +1,54 @@
+# Учет веса запросов к Binance (weights.py, sessions.binance_get) на локальном заменителе с лимитом веса
+import time
+
+import pytest
+
+import mock_servers
+import sessions
+from weights import WeightBudget, RateLimited, request_weight
+
+
+@pytest.fixture
+def binance(monkeypatch):
+    # Вес в заменителе считается по минутам: не начинаем проверку на границе минуты
+    if time.time() % 60 > 55:
+        time.sleep(60 - time.time() % 60)
+    server = mock_servers.serve(weight_limit=4)
+    monkeypatch.setattr(sessions, "BINANCE_API_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(sessions, "binance_weights", WeightBudget(6000))
+    yield server
+    server.shutdown()
+
+
+def test_429_pauses_requests_instead_of_retrying(binance):
+    params = {"symbol": "ETHUSDT"}
+    for used in (2, 4):
+        response = sessions.binance_get("/api/v3/ticker/price", params)
+        assert response.status_code == 200
+        # Расход берется из заголовка X-MBX-USED-WEIGHT-1M
+        assert sessions.binance_weights.remaining() == 6000 * 0.9 - used
+
+    # Превышение лимита: ответ 429 возвращается сразу, без повторов по Retry-After
+    started = time.time()
+    response = sessions.binance_get("/api/v3/ticker/price", params)
+    assert response.status_code == 429
+    assert time.time() - started < 1
+    assert binance.state.requests["/api/v3/ticker/price"] == 3
+    assert sessions.binance_weights.blocked() > 0
+    assert not sessions.binance_weights.allows(request_weight("/api/v3/ticker/price", params))
+
+    # Пока действует запрет, запросы не отправляются
+    with pytest.raises(RateLimited):
+        sessions.binance_get("/api/v3/ticker/price", params)
+    assert binance.state.requests["/api/v3/ticker/price"] == 3
+
+
+def test_backoff_without_retry_after():
+    budget = WeightBudget(100)
+    budget.observe(429, {}, now=0)
+    assert budget.blocked(now=0) == 1
+    budget.observe(429, {}, now=0)
+    assert budget.blocked(now=0) == 2
+    budget.observe(200, {"X-MBX-USED-WEIGHT-1M": "10"}, now=0)
+    assert budget.strikes == 0
+    assert budget.remaining(now=0) == 80
@@ -0,0 +1,109 @@
+# Учет веса запросов к REST API Binance: лимит веса считается по IP за минуту, текущий
+# расход сообщается в заголовке X-MBX-USED-WEIGHT-1M, а за превышение выдаются 429 и бан (418)
+import threading
+import time
+
+# Вес запросов по документации Binance; запросы, которых нет в таблице, стоят 1
+REQUEST_WEIGHTS = {
+    "/api/v3/klines": 2,
+    "/api/v3/exchangeInfo": 20,
+}
+
+# Задержки (в секундах) при 429 и 418 без заголовка Retry-After; удваиваются при повторах
+RATE_LIMIT_BACKOFF = 1
+BAN_BACKOFF = 60
+MAX_BACKOFF = 600
+
+
+# Вес запроса path с параметрами params
+def request_weight(path, params=None):
+    if path == "/api/v3/ticker/price":
+        # Цена одного символа стоит 2, список символов или весь рынок - 4
+        return 2 if params and "symbol" in params else 4
+    return REQUEST_WEIGHTS.get(path, 1)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Запросы к Binance приостановлены еще на {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+class WeightBudget:
+    # limit - лимит веса в минуту, reserve - доля лимита, которая не расходуется (запас для
+    # команд пользователей и других процессов), scarce - доля лимита, при остатке меньше которой
+    # необязательные запросы откладываются
+    def __init__(self, limit, reserve=0.1, scarce=0.5):
+        self.limit = limit
+        self.reserve = reserve
+        self.scarce = scarce
+        self.lock = threading.Lock()
+        # Минута (номер от начала эпохи), к которой относится used
+        self.window = None
+        # Израсходованный за эту минуту вес: из заголовка ответа плюс оценка запросов после него
+        self.used = 0
+        # Время, до которого запросы запрещены после 429 или 418, и число таких ответов подряд
+        self.blocked_until = 0.0
+        self.strikes = 0
+
+    def _roll(self, now):
+        window = int(now // 60)
+        if window != self.window:
+            self.window = window
+            self.used = 0
+
+    # Сколько секунд еще нельзя отправлять запросы (0 - можно)
+    def blocked(self, now=None):
+        now = time.time() if now is None else now
+        return max(0.0, self.blocked_until - now)
+
+    # Вес, который еще можно израсходовать в текущей минуте с учетом запаса
+    def remaining(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self._roll(now)
+            return self.limit * (1 - self.reserve) - self.used
+
+    # Можно ли сейчас отправить запрос весом weight; optional=True - запрос можно отложить,
+    # и при нехватке веса он не отправляется
+    def allows(self, weight, optional=False, now=None):
+        now = time.time() if now is None else now
+        if self.blocked(now):
+            return False
+        remaining = self.remaining(now)
+        if optional and remaining < self.limit * self.scarce:
+            return False
+        return remaining >= weight
+
+    # Учитывает отправляемый запрос; при действующем запрете вызывает RateLimited
+    def spend(self, weight, now=None):
+        now = time.time() if now is None else now
+        wait = self.blocked(now)
+        if wait:
+            raise RateLimited(wait)
+        with self.lock:
+            self._roll(now)
+            self.used += weight
+
+    # Обновляет расход по ответу Binance и при 429 или 418 приостанавливает запросы
+    def observe(self, status, headers, now=None):
+        now = time.time() if now is None else now
+        used = headers.get("X-MBX-USED-WEIGHT-1M") or headers.get("X-MBX-USED-WEIGHT")
+        with self.lock:
+            self._roll(now)
+            if used is not None:
+                try:
+                    self.used = int(used)
+                except ValueError:
+                    pass
+            if status not in (429, 418):
+                self.strikes = 0
+                return
+            self.strikes += 1
+            retry_after = headers.get("Retry-After")
+            try:
+                wait = float(retry_after)
+            except (TypeError, ValueError):
+                base = BAN_BACKOFF if status == 418 else RATE_LIMIT_BACKOFF
+                wait = min(MAX_BACKOFF, base * 2 ** (self.strikes - 1))
+            self.blocked_until = max(self.blocked_until, now + wait)